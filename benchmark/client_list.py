@@ -0,0 +1,69 @@
+"""Compare the loading strategies of /client/list over a seeded dataset.
+
+'joinedload' is the previous strategy (JOIN + LIMIT wrapped in a subquery),
+'selectinload' the current one and 'summary' the fields=summary path:
+
+    python -m benchmark.client_list --clients 10000 --max-favorites 500
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Dict, List
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, joinedload, selectinload
+from benchmark.seed import seed
+from client.models.client_model import Client
+from client.routers.client_router import ClientResponse, ClientSchema
+
+STRATEGIES = {
+    'joinedload': (joinedload(Client.favorite_products), ClientSchema),
+    'selectinload': (selectinload(Client.favorite_products), ClientSchema),
+    'summary': (None, ClientResponse),
+}
+
+def run(url: str, strategy: str, pages: List[int], page_size: int) -> Dict[str, float]:
+    option, schema = STRATEGIES[strategy]
+    engine = create_engine(url)
+    timings = []
+
+    for page in pages:
+        with Session(engine) as db:
+            start = time.perf_counter()
+            query = db.query(Client).order_by(Client.created_at, Client.id)
+            if option is not None:
+                query = query.options(option)
+            clients = query.offset((page - 1) * page_size).limit(page_size).all()
+            for client in clients:
+                schema.model_validate(client, from_attributes=True).model_dump_json()
+            timings.append(time.perf_counter() - start)
+
+    engine.dispose()
+    return {'pages': len(timings), 'mean_ms': round(statistics.mean(timings) * 1000, 2),
+            'p95_ms': round(statistics.quantiles(timings, n=20)[18] * 1000, 2)}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='sqlite:///.bench.db')
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--max-favorites', type=int, default=500)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data already in --url')
+    args = parser.parse_args()
+
+    results = {}
+    if not args.skip_seed:
+        results['favorites'] = seed(args.url, args.clients, args.products, args.max_favorites)['favorites']
+
+    last_page = max(args.clients // args.page_size, 1)
+    pages = [random.randint(1, last_page) for _ in range(args.pages)]
+    for strategy in STRATEGIES:
+        results[strategy] = run(args.url, strategy, pages, args.page_size)
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import asyncio
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from main import create_app
+from shared import cache as cache_module, settings
+from shared.cache import NullCache, create_cache, current_cache
+from shared.database import _async_url
+from shared.dependencies import get_async_db, get_db
+
+# a scenario builds one request function per worker, so a worker can keep state between its requests (e.g. a cursor)
+RequestFunction = Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]
+Scenario = Callable[[], RequestFunction]
+
+RESPONSE_CACHE_ROUTES = settings.RESPONSE_CACHE_ROUTES
+
+def async_url(url: str) -> str:
+    return _async_url(make_url(url)).render_as_string(hide_password=False)
+
+def configure_cache(enabled: bool) -> None:
+    # the read-through cache and the first-page response cache are process wide, so one app (or scenario)
+    # would warm them for the next: off unless the run is about them, then emptied before each load
+    cache_module.cache = create_cache() if enabled else NullCache()
+    # read by HttpCacheMiddleware when the app is built
+    settings.RESPONSE_CACHE_ROUTES = RESPONSE_CACHE_ROUTES if enabled else ''
+
+def sync_app(url: str, cache: bool = False) -> FastAPI:
+    configure_cache(cache)
+    app = create_app(async_db=False)
+    session_factory = sessionmaker(autoflush=False, bind=create_engine(url))
+
+    def override_get_db():
+        with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    return app
+
+def async_app(url: str, cache: bool = False) -> FastAPI:
+    configure_cache(cache)
+    app = create_app(async_db=True)
+    session_factory = async_sessionmaker(autoflush=False, bind=create_async_engine(url))
+    sync_url = make_url(url)
+    sync_session_factory = sessionmaker(autoflush=False, bind=create_engine(sync_url.set(drivername=sync_url.get_backend_name())))
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    # the async handlers that stream their body (bulk import, export) keep a sync session
+    def override_get_db():
+        with sync_session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_db] = override_get_db
+    return app
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, Any]:
+    # statistics.quantiles needs two points at least
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [latencies[0] if latencies else 0.0] * 99
+    return {'requests': len(latencies), 'errors': errors, 'requests_per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentiles[49] * 1000, 2), 'p95_ms': round(percentiles[94] * 1000, 2),
+            'p99_ms': round(percentiles[98] * 1000, 2)}
+
+async def load(app: FastAPI, scenario: Scenario, requests: int, concurrency: int) -> Dict[str, Any]:
+    # driven in-process through the ASGI transport, so the numbers leave out the network and the server
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+    current_cache().clear()
+
+    async def worker(http: httpx.AsyncClient) -> None:
+        nonlocal errors
+        request = scenario()
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await request(http)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app, raise_app_exceptions=False), base_url='http://bench') as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(latencies, elapsed, errors)
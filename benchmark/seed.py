@@ -0,0 +1,73 @@
+"""Build a benchmark dataset of products, clients and their favorites:
+
+    python -m benchmark.seed --url sqlite:///.bench.db --clients 10000 --products 5000 --max-favorites 50
+"""
+import argparse
+import json
+import random
+from typing import Dict
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from client.jobs.co_favorites import rebuild_co_favorites
+from client.jobs.favorite_counts import reconcile_favorite_counts
+from client.models.client_model import Client, client_product
+from client.models.product_model import Product
+from shared.database import Base
+
+def seed(url: str, clients: int = 0, products: int = 1000, max_favorites: int = 0, chunk: int = 50000,
+         seed_value: int = 0) -> Dict[str, int]:
+    # the same arguments (and seed_value) always build the same rows
+    rng = random.Random(seed_value)
+    engine = create_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == 'sqlite':
+        # persistent setting of the file: readers no longer block the writer, without it
+        # the concurrent write scenarios mostly measure "database is locked" timeouts
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+    favorites = 0
+
+    with engine.begin() as conn:
+        for start in range(0, products, chunk):
+            conn.execute(insert(Product), [{'price': round(rng.uniform(1, 1000), 2), 'image': f'img{i}.jpg', 'brand': f'Brand {i % 50}',
+                                            'title': f'Title {i}', 'review_score': round(rng.uniform(0, 5), 2)}
+                                           for i in range(start, min(start + chunk, products))])
+        for start in range(0, clients, chunk):
+            conn.execute(insert(Client), [{'name': f'Client {i}', 'email': f'client{i}@mail.com'}
+                                          for i in range(start, min(start + chunk, clients))])
+
+        rows = []
+        for id_client in range(1, clients + 1):
+            for id_product in rng.sample(range(1, products + 1), rng.randint(0, min(max_favorites, products))):
+                rows.append({'client_id': id_client, 'product_id': id_product})
+            if len(rows) >= chunk:
+                conn.execute(insert(client_product), rows)
+                favorites += len(rows)
+                rows = []
+        if rows:
+            conn.execute(insert(client_product), rows)
+            favorites += len(rows)
+
+    # the favorites are inserted behind the API's back, bring Product.favorite_count and the co-favorite index in line
+    if favorites:
+        with Session(engine) as db:
+            reconcile_favorite_counts(db)
+            rebuild_co_favorites(db)
+
+    engine.dispose()
+    return {'clients': clients, 'products': products, 'favorites': favorites}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='sqlite:///.bench.db')
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--max-favorites', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(seed(args.url, args.clients, args.products, args.max_favorites, seed_value=args.seed), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Rows/sec of /product/list on the fast read path (Core rows + orjson) and the ORM path
+(ORM objects validated through response_model), toggled with settings.FAST_READS:
+
+    python -m benchmark.serialization --products 20000 --page-size 1000
+"""
+import argparse
+import json
+import time
+from fastapi.testclient import TestClient
+from benchmark.harness import sync_app
+from benchmark.seed import seed
+from shared import settings
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='sqlite:///.bench.db')
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    seed(args.url, products=args.products)
+    client = TestClient(sync_app(args.url))
+    pages = (args.products + args.page_size - 1) // args.page_size
+
+    results = {}
+    for name, fast_reads in (('orm', False), ('fast', True)):
+        settings.FAST_READS = fast_reads
+        rows = 0
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for page in range(1, pages + 1):
+                rows += len(client.get('/product/list', params={'page': page, 'page_size': args.page_size}).json())
+        elapsed = time.perf_counter() - start
+        results[name] = {'rows': rows, 'rows_per_sec': round(rows / elapsed)}
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
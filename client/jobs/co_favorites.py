@@ -0,0 +1,64 @@
+from importlib.util import find_spec
+from typing import Iterator, List, Tuple
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.orm import Session
+from client.models.client_model import client_product
+from client.models.product_model import product_co_favorite
+from shared import settings
+from shared.database import SessionLocal, get_engine
+
+# Rebuilds the co-favorite index (product_co_favorite) from client_product, the favorite writes keep
+# it current in between (see adjust_co_favorites). Run it once to build it and periodically after:
+#   python -m client.jobs.co_favorites
+#
+# With scipy installed the pairs come from one sparse product: A is the clients x products matrix
+# of favorites and A.T @ A counts, for every pair of products, the clients having both. Without it
+# the database computes the same counts with a grouped self-join of client_product.
+
+def _sparse_pairs(db: Session) -> Iterator[Tuple[int, int, int]]:
+    import numpy
+    from scipy import sparse
+
+    favorites = numpy.array(db.execute(select(client_product.c.client_id, client_product.c.product_id)).all(), dtype=numpy.int64)
+    if not len(favorites):
+        return
+
+    clients, products = favorites[:, 0], favorites[:, 1]
+    matrix = sparse.csr_matrix((numpy.ones(len(favorites), dtype=numpy.int32), (clients, products)),
+                               shape=(clients.max() + 1, products.max() + 1))
+    co_favorites = (matrix.T @ matrix).tocoo()
+    related = co_favorites.row != co_favorites.col
+    yield from zip(co_favorites.row[related].tolist(), co_favorites.col[related].tolist(), co_favorites.data[related].tolist())
+
+def _insert_pairs(db: Session, pairs: Iterator[Tuple[int, int, int]]) -> int:
+    inserted = 0
+    chunk: List[dict] = []
+    for product_id, related_id, count in pairs:
+        chunk.append({'product_id': product_id, 'related_id': related_id, 'count': count})
+        if len(chunk) == settings.BULK_CHUNK_SIZE:
+            db.execute(insert(product_co_favorite), chunk)
+            inserted += len(chunk)
+            chunk = []
+    if chunk:
+        db.execute(insert(product_co_favorite), chunk)
+        inserted += len(chunk)
+    return inserted
+
+def rebuild_co_favorites(db: Session) -> int:
+    # one transaction: readers keep seeing the previous index until the commit
+    db.execute(delete(product_co_favorite))
+    if find_spec('scipy') is not None:
+        inserted = _insert_pairs(db, _sparse_pairs(db))
+    else:
+        first, second = client_product.alias(), client_product.alias()
+        pairs = (select(first.c.product_id, second.c.product_id, func.count())
+                 .join(second, and_(second.c.client_id == first.c.client_id, second.c.product_id != first.c.product_id))
+                 .group_by(first.c.product_id, second.c.product_id))
+        inserted = db.execute(insert(product_co_favorite).from_select(['product_id', 'related_id', 'count'], pairs)).rowcount
+
+    db.commit()
+    return inserted
+
+if __name__ == '__main__':
+    with SessionLocal(bind=get_engine()) as db:
+        print(f'indexed {rebuild_co_favorites(db)} product pairs')
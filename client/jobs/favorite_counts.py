@@ -0,0 +1,21 @@
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+from client.models.client_model import client_product
+from client.models.product_model import Product
+from shared.database import SessionLocal, get_engine
+
+# Recomputes Product.favorite_count from client_product in one statement, for when
+# the denormalized counts drift (e.g. rows written outside the API). Run it periodically:
+#   python -m client.jobs.favorite_counts
+
+def reconcile_favorite_counts(db: Session) -> int:
+    counted = select(func.count()).where(client_product.c.product_id == Product.id).scalar_subquery()
+    # only the drifted rows are written, updated_at/version are left alone like in adjust_favorite_counts
+    result = db.execute(update(Product).where(Product.favorite_count != counted)
+                        .values(favorite_count=counted, updated_at=Product.updated_at, version=Product.version))
+    db.commit()
+    return result.rowcount
+
+if __name__ == '__main__':
+    with SessionLocal(bind=get_engine()) as db:
+        print(f'reconciled {reconcile_favorite_counts(db)} products')
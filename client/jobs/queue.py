@@ -0,0 +1,134 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from fastapi import HTTPException
+from sqlalchemy import Row, and_, or_, select, update
+from sqlalchemy.orm import Session
+from client.models.job_model import Job
+from shared import settings
+from shared.cache import current_cache
+from shared.database import SessionLocal, get_engine
+from shared.exceptions import NotFound
+from shared.http_cache import invalidate_responses
+
+# Background mode of the heavy writes (SOLARIS_BACKGROUND_WRITES): the endpoint records a job and
+# answers 202, a worker thread of the same process applies the pending jobs of the table in batched
+# transactions. A job still pending for the same target takes the new payload instead of queueing
+# another one, the requests replace the whole state of their target so only the last one matters.
+# The table is the queue: each job is claimed by a single process, and the jobs a stopped process left
+# pending (or running, see _claim) are applied at the next startup.
+
+# applies one job inside the batch transaction, without committing, and returns the cache keys to invalidate
+Handler = Callable[[Session, int, Dict[str, Any]], List[str]]
+
+def _error_message(exc: Exception) -> str:
+    if isinstance(exc, HTTPException):
+        return str(exc.detail)
+    if isinstance(exc, NotFound):
+        return f'{exc.name} not found.'
+    return f'{type(exc).__name__}: {exc}'
+
+class JobQueue:
+    def __init__(self):
+        self.handlers: Dict[str, Handler] = {}
+        # only guards the wakeups, never held across database I/O (the async routes submit from the event loop)
+        self._condition = threading.Condition()
+        self._wanted = False
+        self._busy = False
+        self._worker: Optional[threading.Thread] = None
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self.handlers[kind] = handler
+
+    def submit(self, db: Session, kind: str, target_id: int, payload: Dict[str, Any]) -> int:
+        # coalesced in the table: once the worker claimed the pending job nothing matches and a new one is queued
+        id_job = db.execute(update(Job).where(Job.kind == kind, Job.target_id == target_id, Job.status == 'pending')
+                            .values(payload=payload).returning(Job.id)).scalars().first()
+        if id_job is None:
+            job = Job(kind=kind, target_id=target_id, payload=payload)
+            db.add(job)
+            db.flush()
+            id_job = job.id
+        db.commit()
+
+        self.start()
+        return id_job
+
+    def start(self) -> None:
+        # wakes the worker up to apply the pending jobs, started on first use, i.e. in the worker process after the fork
+        with self._condition:
+            self._wanted = True
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='solaris-jobs', daemon=True)
+                self._worker.start()
+            self._condition.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        # until every submitted job is applied (or failed), e.g. on shutdown
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._wanted and not self._busy, timeout)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._wanted)
+                self._wanted = False
+                self._busy = True
+
+            try:
+                # until the table has no pending job left, those submitted in the meantime included
+                while self._apply_next():
+                    pass
+            finally:
+                # an error (e.g. the database is down) ends the thread, the next submit starts another one
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _apply_next(self) -> bool:
+        with SessionLocal(bind=get_engine()) as db:
+            jobs = self._claim(db)
+            if not jobs:
+                return False
+
+            try:
+                keys = self._apply_together(db, jobs)
+            except Exception:
+                db.rollback()
+                # one of them failed: apply them one transaction each to find it, the others still go through
+                keys = []
+                for job in jobs:
+                    try:
+                        keys += self._apply_together(db, [job])
+                    except Exception as exc:
+                        db.rollback()
+                        db.execute(update(Job).where(Job.id == job.id, Job.status == 'running')
+                                   .values(status='failed', error=_error_message(exc)[:200]))
+                        db.commit()
+
+        current_cache().delete(*keys)
+        invalidate_responses()
+        return True
+
+    def _claim(self, db: Session) -> List[Row]:
+        # a short transaction of its own, committed before the handlers run: a submit for a claimed target finds
+        # no pending job and queues a new one rather than waiting for the batch, and the workers of the other
+        # processes skip the rows being claimed (SKIP LOCKED, ignored by sqlite where the writes are serialized).
+        # A claim older than SOLARIS_JOB_CLAIM_TIMEOUT belongs to a process that stopped while applying it.
+        stale = datetime.now() - timedelta(seconds=settings.JOB_CLAIM_TIMEOUT)
+        claimable = select(Job.id).where(or_(Job.status == 'pending', and_(Job.status == 'running', Job.updated_at < stale))) \
+                                  .order_by(Job.id).limit(settings.JOB_BATCH_SIZE).with_for_update(skip_locked=True)
+        jobs = db.execute(update(Job).where(Job.id.in_(claimable.scalar_subquery())).values(status='running')
+                          .returning(Job.id, Job.kind, Job.target_id, Job.payload)).all()
+        db.commit()
+        return sorted(jobs, key=lambda job: job.id)
+
+    def _apply_together(self, db: Session, jobs: List[Row]) -> List[str]:
+        keys = []
+        for job in jobs:
+            keys += self.handlers[job.kind](db, job.target_id, job.payload)
+        db.execute(update(Job).where(Job.id.in_([job.id for job in jobs]), Job.status == 'running').values(status='done'))
+        db.commit()
+        return keys
+
+job_queue = JobQueue()
@@ -1,12 +1,14 @@
+from datetime import datetime
 from shared.database import Base
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Table
-from sqlalchemy.sql import func
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, Table, literal_column
 from sqlalchemy.orm import relationship
 
 # Association Client-Product
 client_product = Table('client_product', Base.metadata,
     Column('client_id', ForeignKey('client.id'), primary_key=True),
-    Column('product_id', ForeignKey('product.id'), primary_key=True)
+    Column('product_id', ForeignKey('product.id'), primary_key=True),
+    # the primary key starts with client_id, this one finds the clients of a product (e.g. delete_product)
+    Index('ix_client_product_product_id', 'product_id'),
 )
 
 class Client(Base):
@@ -14,5 +16,17 @@ class Client(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(50), nullable=False)
     email = Column(String(50), nullable=False)
-    created_at = Column(DateTime, default=func.now())
-    favorite_products = relationship('Product', secondary='client_product', back_populates='clients')
\ No newline at end of file
+    # set by the application so the stored value keeps microseconds on every backend
+    # (sqlite's CURRENT_TIMESTAMP is truncated to seconds and breaks keyset pagination)
+    created_at = Column(DateTime, default=datetime.now)
+    # bumped by every UPDATE of the row, feeds the ETag of /client/{id}
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    version = Column(Integer, nullable=False, default=1, server_default='1', onupdate=literal_column('version') + 1)
+    favorite_products = relationship('Product', secondary='client_product', back_populates='clients')
+
+    __table_args__ = (
+        # backs the keyset pagination of /client/list
+        Index('ix_client_created_at_id', 'created_at', 'id'),
+        # duplicate emails are rejected by the database, see register_client/update_client
+        Index('ix_client_email', 'email', unique=True),
+    )
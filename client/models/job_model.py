@@ -0,0 +1,16 @@
+from datetime import datetime
+from sqlalchemy import JSON, Column, DateTime, Integer, String
+from shared.database import Base
+
+# a mutation accepted with 202 and applied by the background queue (see client/jobs/queue.py)
+class Job(Base):
+    __tablename__ = 'job'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(50), nullable=False)
+    target_id = Column(Integer, nullable=False)
+    payload = Column(JSON)
+    # pending, running (claimed by a worker), done or failed
+    status = Column(String(20), nullable=False, default='pending')
+    error = Column(String(200))
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Numeric
+from datetime import datetime
+from sqlalchemy import DDL, Column, DateTime, ForeignKey, Index, Integer, String, Numeric, Table, event, literal_column
 from shared.database import Base
 from sqlalchemy.orm import relationship
 
@@ -10,4 +11,33 @@ class Product(Base):
     brand = Column(String(50))
     title = Column(String(50))
     review_score = Column(Numeric)
+    # bumped by every UPDATE of the row, feeds the ETag of /product/{id}
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    version = Column(Integer, nullable=False, default=1, server_default='1', onupdate=literal_column('version') + 1)
+    # denormalized count of client_product rows, maintained by the favorite writes
+    favorite_count = Column(Integer, nullable=False, default=0, server_default='0')
     clients = relationship('Client', secondary='client_product', back_populates='favorite_products')
+
+    __table_args__ = (
+        # filters and sort orders of /product/list, the id makes the keyset seek exact
+        Index('ix_product_brand_id', 'brand', 'id'),
+        Index('ix_product_price_id', 'price', 'id'),
+        Index('ix_product_review_score_id', 'review_score', 'id'),
+        # /product/top
+        Index('ix_product_favorite_count_id', 'favorite_count', 'id'),
+        # title substring/prefix search (ILIKE '%...%'), postgres only
+        Index('ix_product_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+event.listen(Product.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+# Co-favorite index: for each ordered pair of products, how many clients have both as favorites.
+# Rebuilt by client/jobs/co_favorites.py and kept current by the favorite writes (see adjust_co_favorites),
+# pairs may drop to 0 until the next rebuild
+product_co_favorite = Table('product_co_favorite', Base.metadata,
+    Column('product_id', ForeignKey('product.id'), primary_key=True),
+    Column('related_id', ForeignKey('product.id'), primary_key=True),
+    Column('count', Integer, nullable=False),
+    # /product/{id}/related reads the top pairs of a product straight from this index
+    Index('ix_product_co_favorite_product_id_count', 'product_id', 'count', 'related_id'),
+)
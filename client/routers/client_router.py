@@ -1,12 +1,22 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session, joinedload
-from client.models.client_model import Client
-from client.models.product_model import Product
-from client.routers.product_router import ProductResponse
-from shared.dependencies import get_db
-from client.routers.utils import search_client_by_id
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Literal, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from sqlalchemy import Row, delete, func, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from client.models.client_model import Client, client_product
+from client.models.product_model import Product, product_co_favorite
+from client.routers.product_router import PRODUCT_COLUMNS, ProductResponse, product_row
+from shared import settings
+from shared.cache import Cache, client_key
+from shared.dependencies import get_cache, get_db
+from client.jobs.queue import job_queue
+from client.routers.utils import NEXT_CURSOR_HEADER, accepted, add_favorites, adjust_co_favorites, adjust_favorite_counts, cache_entry, clear_favorites, \
+                                 conditional_response, decode_cursor, encode_cursor, etag_matches, not_modified, remove_favorites, row_etag, \
+                                 search_client_by_id, seek_after, set_last_modified, touch_clients
 from shared.exceptions import NotFound
 
 router = APIRouter(prefix="/client")
@@ -16,8 +26,7 @@ class ClientResponse(BaseModel):
     name: str
     email: str
 
-    class Config:
-        orm_model = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ClientRequest(BaseModel):
     name: str = Field(min_length=3, max_length=50)
@@ -29,6 +38,16 @@ class ClientSchema(ClientResponse):
 class ClientSchemaRequest(ClientRequest):
     favorite_products: List[int]
 
+class FavoritesRequest(BaseModel):
+    product_ids: List[int]
+
+# full: ClientSchema with the favorite products, summary: ClientResponse without them (no extra query)
+ClientFields = Literal['full', 'summary']
+
+class RecommendedProductResponse(ProductResponse):
+    # co-favorites summed over the client's favorites
+    score: int
+
 class ProductSchema(ProductResponse):
     clients: List[ClientResponse]
 
@@ -36,75 +55,269 @@ class ProductSchema(ProductResponse):
 # def list_clients(db: Session = Depends(get_db)) -> List[Client]:
 #     return db.query(Client).order_by(Client.created_at).all()
 
+CLIENT_COLUMNS = (Client.id, Client.name, Client.email)
+CLIENT_FIELDS = tuple(column.key for column in CLIENT_COLUMNS)
+
+def client_rows(db: Session, clients: List[Row], fields: ClientFields) -> List[Dict[str, Any]]:
+    # fast path of list_clients: same payload as ClientSchema/ClientResponse built from Core rows
+    payload = [dict(zip(CLIENT_FIELDS, row)) for row in clients]
+    if fields == 'full':
+        favorites = {client['id']: client.setdefault('favorite_products', []) for client in payload}
+        if favorites:
+            rows = db.execute(select(client_product.c.client_id, *PRODUCT_COLUMNS).
+                              join(Product, Product.id == client_product.c.product_id).
+                              where(client_product.c.client_id.in_(favorites)))
+            for id_client, *product in rows:
+                favorites[id_client].append(product_row(product))
+
+    return payload
+
 # TODO: refactor this to use fastapi_pagination
-@router.get("/list", response_model=List[ClientSchema])
-def list_clients(page: int = Query(1, gt=0), db: Session = Depends(get_db)) -> List[ClientSchema]:
+@router.get("/list", response_model=Union[List[ClientSchema], List[ClientResponse]])
+def list_clients(response: Response, page: int = Query(1, gt=0), cursor: Optional[str] = None, fields: ClientFields = 'full',
+                 db: Session = Depends(get_db)) -> Union[List[ClientSchema], List[ClientResponse]]:
     limit_per_page = 20
-    offset = (page - 1) * limit_per_page
-    return db.query(Client).options(joinedload(Client.favorite_products)).order_by(Client.created_at).offset(offset).limit(limit_per_page).all()
+    statement = select(Client).order_by(Client.created_at, Client.id)
+
+    # the cursor takes precedence over page: it seeks straight to the last row seen
+    # through ix_client_created_at_id instead of scanning and discarding the offset
+    if cursor is not None:
+        created_at, id_client = decode_cursor(cursor, datetime.fromisoformat, int)
+        statement = statement.where(seek_after((Client.created_at, Client.id), (created_at, id_client)))
+    else:
+        statement = statement.offset((page - 1) * limit_per_page)
+    statement = statement.limit(limit_per_page)
+
+    if settings.FAST_READS:
+        clients = db.execute(statement.with_only_columns(*CLIENT_COLUMNS, Client.created_at, Client.updated_at)).all()
+        response = ORJSONResponse(client_rows(db, clients, fields))
+    elif fields == 'full':
+        # selectinload fetches the favorites of the whole page with a second IN query, unlike joinedload
+        # it doesn't multiply the page rows by their favorites nor wrap the LIMIT in a subquery
+        clients = db.scalars(statement.options(selectinload(Client.favorite_products))).all()
+    else:
+        clients = db.scalars(statement).all()
+
+    if len(clients) == limit_per_page:
+        last = clients[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at.isoformat(), last.id)
+    set_last_modified(response, clients)
+
+    if settings.FAST_READS:
+        return response
+    if fields == 'summary':
+        return [ClientResponse.model_validate(client, from_attributes=True) for client in clients]
+    return clients
+
+def export_clients_ndjson(bind: Engine) -> Iterator[bytes]:
+    # own session: the request's one is closed before the response body is sent
+    with Session(bind=bind, autoflush=False) as db:
+        # yield_per streams the rows through a server-side cursor and selectinload
+        # fetches the favorites of each batch with one IN query
+        clients = db.scalars(select(Client).options(selectinload(Client.favorite_products)).order_by(Client.id).
+                             execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+
+        for batch in clients.partitions():
+            yield b''.join(ClientSchema.model_validate(client, from_attributes=True).model_dump_json().encode() + b'\n'
+                           for client in batch)
+
+# async so the async stack serves it as is: no query runs here, only in the streamed body
+@router.get("/export", response_class=StreamingResponse)
+async def export_clients(db: Session = Depends(get_db)) -> StreamingResponse:
+    return StreamingResponse(export_clients_ndjson(db.get_bind()), media_type='application/x-ndjson')
+
+def check_batch_size(size: int) -> None:
+    if size > settings.BATCH_MAX_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {settings.BATCH_MAX_SIZE} clients per batch.")
+
+# the batch endpoints run in one transaction with a fixed number of statements whatever the batch size
+@router.post("/batch", response_model=List[ClientResponse], status_code=201)
+def register_clients(client_requests: List[ClientRequest], db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> List[Row]:
+    check_batch_size(len(client_requests))
+    if not client_requests:
+        return []
+
+    # one multi-row INSERT ... RETURNING (split in pages by the dialect when needed), all or nothing on a duplicate email;
+    # asking for the rows in parameter order would fall back to a statement per row on some backends,
+    # the unique email maps them back instead
+    try:
+        clients = db.execute(insert(Client).returning(*CLIENT_COLUMNS), [client_request.model_dump() for client_request in client_requests]).all()
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Email already registered.")
+    cache.delete(*(client_key(client.id) for client in clients))
+
+    by_email = {client.email: client for client in clients}
+    return [by_email[client_request.email] for client_request in client_requests]
+
+@router.get("/batch", response_model=List[ClientSchema])
+def clients_by_ids(ids: List[int] = Query(...), db: Session = Depends(get_db)) -> List[Client]:
+    check_batch_size(len(ids))
+    # unknown ids are left out, the favorites of every client come with a second IN query
+    statement = select(Client).where(Client.id.in_(set(ids))).order_by(Client.id)
+
+    if settings.FAST_READS:
+        clients = db.execute(statement.with_only_columns(*CLIENT_COLUMNS)).all()
+        return ORJSONResponse(client_rows(db, clients, 'full'))
+
+    return db.scalars(statement.options(selectinload(Client.favorite_products))).all()
+
+@router.delete("/batch", status_code=204)
+def delete_clients(ids: List[int] = Query(...), db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> None:
+    check_batch_size(len(ids))
+    clear_favorites(ids, db)
+    db.execute(delete(Client).where(Client.id.in_(set(ids))))
+    db.commit()
+    cache.delete(*(client_key(id_client) for id_client in set(ids)))
 
 # @router.get("/{id_client}", response_model=ClientResponse)
 # def client_by_id(id_client: int, db: Session = Depends(get_db)) -> ClientResponse:
 #     return search_client_by_id(id_client, db)
 
-@router.get("/{id_client}", response_model=ClientSchema)
-def client_by_id(id_client: int, db: Session = Depends(get_db)):
-    # client = db.query(Client).options(joinedload(Client.favorite_products)).\
-    #         where(Client.id == id_client).one()
-    client = db.query(Client).options(joinedload(Client.favorite_products)).\
-             where(Client.id == id_client).one_or_none()
-    
-    if client is None:
-        raise NotFound('Client')
-    
-    return client
+@router.get("/{id_client}", response_model=Union[ClientSchema, ClientResponse])
+def client_by_id(id_client: int, request: Request, fields: ClientFields = 'full', db: Session = Depends(get_db), cache: Cache = Depends(get_cache)):
+    # only the full payload is cached, the summary is a single primary key lookup
+    summary = fields == 'summary'
+    key = client_key(id_client)
+    entry = None if summary else cache.get(key)
 
-@router.post("/register", response_model=ClientResponse, status_code=201)
-def register_client(client_request: ClientRequest, db: Session = Depends(get_db)) -> ClientResponse:
-    # CHECK IF THE EMAIL IS AREADY IN USE
-    # TODO: refactor this check to use some sqlalchemy notation
-    # TODO: move this to exceptions_handler section
-    db_client = db.query(Client).filter(Client.email == client_request.email).first()
-    if db_client:
-        raise HTTPException(status_code=409, detail="Email already registered.")
+    if entry is None:
+        lease = None if summary else cache.lease(key)
+        client: Client = search_client_by_id(id_client, db)
+
+        # the caller already has this version, skip loading the favorites and serializing them
+        etag = row_etag(client)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        # the favorites are lazy loaded by ClientSchema, one query for the relationship
+        schema = ClientResponse if summary else ClientSchema
+        entry = cache_entry(etag, schema.model_validate(client, from_attributes=True).model_dump_json().encode())
+        if not summary:
+            cache.fill(key, entry, lease)
 
+    return conditional_response(request, entry)
+
+@router.post("/register", response_model=ClientResponse, status_code=201)
+def register_client(client_request: ClientRequest, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> ClientResponse:
     new_client = Client(**client_request.dict())
     db.add(new_client)
-    db.commit()
+    # a single INSERT, the unique index on email settles concurrent registrations
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Email already registered.")
     db.refresh(new_client)
+    # ids can be handed out again (e.g. sqlite reuses the highest one after it is deleted)
+    cache.delete(client_key(new_client.id))
 
     # return ClientResponse(**new_client.__dict__)
     return new_client
 
-@router.put("/update/{id_client}", response_model=ClientSchema, status_code=200)
-def update_client(id_client: int, client_request: ClientSchemaRequest, db: Session = Depends(get_db)) -> ClientResponse:
-    client: ClientSchema = db.query(Client).options(joinedload(Client.favorite_products)).\
-             where(Client.id == id_client).one_or_none()
-    
-    if client is None:
-        raise NotFound('Client')
-    
-    if db.query(Client).filter(Client.email == client_request.email, Client.id != client.id).first():
-        raise HTTPException(status_code=409, detail="Email already in use.")
+def apply_client_update(id_client: int, client_request: ClientSchemaRequest, db: Session) -> Client:
+    # everything but the commit, shared by update_client and its background job
+    client: Client = search_client_by_id(id_client, db)
 
     client.name = client_request.name
     client.email = client_request.email
+    # always issue the UPDATE, a change limited to the favorites must bump the version as well
+    client.updated_at = datetime.now()
+    # flushed on its own so a duplicate email (unique index) isn't mistaken for a favorites failure
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Email already in use.")
+
+    # resolve every requested product in one query and write only the difference to the association
+    requested = set(client_request.favorite_products)
+    favorites = set(db.scalars(select(Product.id).where(Product.id.in_(requested)))) if requested else set()
+    current = set(db.scalars(select(client_product.c.product_id).where(client_product.c.client_id == client.id)))
+
+    added = favorites - current
+    if added:
+        db.execute(insert(client_product), [{'client_id': client.id, 'product_id': product_id} for product_id in added])
+        adjust_favorite_counts(added, db)
+        adjust_co_favorites([client.id], added, db)
+
+    removed = current - favorites
+    if removed:
+        remove_favorites(client.id, removed, db)
+
+    return client
+
+def client_update_job(db: Session, id_client: int, payload: Dict[str, Any]) -> List[str]:
+    apply_client_update(id_client, ClientSchemaRequest(**payload), db)
+    return [client_key(id_client)]
 
-    # TODO: create an endpoint to just add new favorites instead of update the whole list (?)
-    client.favorite_products.clear()
-    for product_id in client_request.favorite_products:
-        db_product = db.query(Product).filter_by(id=product_id).one_or_none()
-        if db_product and db_product not in client.favorite_products:
-            client.favorite_products.append(db_product)
+job_queue.register('client_update', client_update_job)
 
-    db.add(client)
+@router.put("/update/{id_client}", response_model=ClientSchema, status_code=200)
+def update_client(id_client: int, client_request: ClientSchemaRequest, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> ClientResponse:
+    # a large favorites rewrite doesn't hold the request (nor its connection), see SOLARIS_BACKGROUND_WRITES
+    if settings.BACKGROUND_WRITES:
+        if db.scalar(select(Client.id).where(Client.id == id_client)) is None:
+            raise NotFound('Client')
+        return accepted(job_queue.submit(db, 'client_update', id_client, client_request.model_dump()))
+
+    client = apply_client_update(id_client, client_request, db)
     db.commit()
+    cache.delete(client_key(client.id))
     db.refresh(client)
 
     return client
 
+# add/remove a batch of favorites without loading (or rewriting) the ones the client already has
+@router.post("/{id_client}/favorites", status_code=204)
+def add_favorite_products(id_client: int, favorites_request: FavoritesRequest, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> None:
+    if db.scalar(select(Client.id).where(Client.id == id_client)) is None:
+        raise NotFound('Client')
+
+    if favorites_request.product_ids:
+        add_favorites(id_client, favorites_request.product_ids, db)
+        touch_clients([id_client], db)
+        db.commit()
+        cache.delete(client_key(id_client))
+
+@router.delete("/{id_client}/favorites", status_code=204)
+def remove_favorite_products(id_client: int, favorites_request: FavoritesRequest, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> None:
+    if db.scalar(select(Client.id).where(Client.id == id_client)) is None:
+        raise NotFound('Client')
+
+    if favorites_request.product_ids:
+        remove_favorites(id_client, favorites_request.product_ids, db)
+        touch_clients([id_client], db)
+        db.commit()
+        cache.delete(client_key(id_client))
+
+# products most often favorited together with the client's own favorites, read from the co-favorite
+# index: one index lookup per favorite rather than a self-join of client_product
+@router.get("/{id_client}/recommendations", response_model=List[RecommendedProductResponse])
+def client_recommendations(id_client: int, limit: int = Query(10, gt=0, le=100), db: Session = Depends(get_db)) -> ORJSONResponse:
+    favorites = select(client_product.c.product_id).where(client_product.c.client_id == id_client)
+    score = func.sum(product_co_favorite.c.count).label('score')
+    ranked = (select(product_co_favorite.c.related_id, score)
+              .where(product_co_favorite.c.product_id.in_(favorites), product_co_favorite.c.count > 0,
+                     product_co_favorite.c.related_id.not_in(favorites))
+              .group_by(product_co_favorite.c.related_id)
+              .order_by(score.desc(), product_co_favorite.c.related_id.desc())
+              .limit(limit).subquery())
+    rows = db.execute(select(*PRODUCT_COLUMNS, ranked.c.score).join(ranked, ranked.c.related_id == Product.id)
+                      .order_by(ranked.c.score.desc(), Product.id.desc())).all()
+
+    if not rows and db.scalar(select(Client.id).where(Client.id == id_client)) is None:
+        raise NotFound('Client')
+
+    return ORJSONResponse([{**product_row(row), 'score': row.score} for row in rows])
+
 @router.delete("/delete/{id_client}", status_code=204)
-def delete_client(id_client: int, db: Session = Depends(get_db)) -> None:
-    client: Client = search_client_by_id(id_client, db)
-    db.delete(client)
+def delete_client(id_client: int, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> None:
+    # drop the association up front so the favorite counts follow, then the row itself without loading it
+    clear_favorites([id_client], db)
+    if db.execute(delete(Client).where(Client.id == id_client)).rowcount == 0:
+        db.rollback()
+        raise NotFound('Client')
     db.commit()
+    cache.delete(client_key(id_client))
@@ -0,0 +1,27 @@
+from typing import Optional
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy.orm import Session
+from client.models.job_model import Job
+from shared.dependencies import get_db
+from shared.exceptions import NotFound
+
+router = APIRouter(prefix="/jobs")
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    target_id: int
+    status: str
+    error: Optional[str]
+
+    model_config = ConfigDict(from_attributes=True)
+
+@router.get("/{id_job}", response_model=JobResponse)
+def job_by_id(id_job: int, db: Session = Depends(get_db)) -> Job:
+    job = db.get(Job, id_job)
+
+    if job is None:
+        raise NotFound('Job')
+
+    return job
@@ -1,11 +1,24 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel
-from sqlalchemy import func
+import csv
+import json
+from typing import Any, Dict, List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, ValidationError
+from sqlalchemy import ColumnElement, Float, Row, delete, func, insert, or_, select, type_coerce
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from client.models.product_model import Product
-from shared.dependencies import get_db
+from client.models.client_model import client_product
+from client.models.product_model import Product, product_co_favorite
+from client.jobs.queue import job_queue
+from client.routers.utils import NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER, TOTAL_PAGES_HEADER, accepted, cache_entry, conditional_response, cursor_decimal, \
+                                 cursor_tag, decode_cursor, encode_cursor, etag_matches, not_modified, row_etag, seek_after, \
+                                 seek_after_nullable, set_last_modified, stream_lines, touch_clients
+from shared import settings
+from shared.cache import Cache, client_key, product_key
+from shared.dependencies import get_cache, get_db
 from shared.exceptions import NotFound
+from shared.row_count import adjust_row_count, row_count
 
 router = APIRouter(prefix="/product")
 
@@ -17,8 +30,14 @@ class ProductResponse(BaseModel):
     title: str
     review_score: float
 
-    class Config:
-        orm_model = True
+    model_config = ConfigDict(from_attributes=True)
+
+class TopProductResponse(ProductResponse):
+    favorite_count: int
+
+class RelatedProductResponse(ProductResponse):
+    # clients having both products as favorites
+    co_favorites: int
 
 class ProductRequest(BaseModel):
     price: float
@@ -27,46 +46,286 @@ class ProductRequest(BaseModel):
     title: str
     review_score: float
 
+class BulkImportError(BaseModel):
+    line: int
+    detail: List[Dict[str, Any]]
+
+class BulkImportResponse(BaseModel):
+    inserted: int
+    failed: int
+    # capped at SOLARIS_BULK_MAX_REPORTED_ERRORS, failed has the full count
+    errors: List[BulkImportError]
+
 # @router.get("/list", response_model=List[ProductResponse])
 # def list_products(db: Session = Depends(get_db)) -> List[Product]:
 #     return db.query(Product).all()
 
+# Core columns of the fast read path, prices come back as floats instead of Decimal
+PRODUCT_COLUMNS = (Product.id, type_coerce(Product.price, Float).label('price'), Product.image, Product.brand,
+                   Product.title, type_coerce(Product.review_score, Float).label('review_score'))
+PRODUCT_FIELDS = tuple(column.key for column in PRODUCT_COLUMNS)
+
+def product_row(row: Row) -> Dict[str, Any]:
+    # rows may carry extra columns after PRODUCT_COLUMNS (e.g. updated_at), zip leaves them out
+    return dict(zip(PRODUCT_FIELDS, row))
+
+ProductSort = Literal['id', 'price', 'review_score']
+SortOrder = Literal['asc', 'desc']
+
+def product_filters(brand: Optional[str], min_price: Optional[float], max_price: Optional[float], min_review_score: Optional[float],
+                    title: Optional[str], title_prefix: Optional[str]) -> List[ColumnElement]:
+    filters = []
+    if brand is not None:
+        filters.append(Product.brand == brand)
+    if min_price is not None:
+        filters.append(Product.price >= min_price)
+    if max_price is not None:
+        filters.append(Product.price <= max_price)
+    if min_review_score is not None:
+        filters.append(Product.review_score >= min_review_score)
+    # case insensitive, served by the trigram index on postgres
+    if title is not None:
+        filters.append(Product.title.icontains(title, autoescape=True))
+    if title_prefix is not None:
+        filters.append(Product.title.istartswith(title_prefix, autoescape=True))
+    return filters
+
 # TODO: refactor this to use fastapi_pagination
 @router.get("/list", response_model=List[ProductResponse])
-def list_products(page: int = Query(1, gt=0), page_size: int = Query(10, gt=0), db: Session = Depends(get_db)) -> List[Product]:
-    total_items = db.query(func.count(Product.id)).scalar()
-    total_pages = (total_items + page_size - 1) // page_size
-    # TODO: move this to exceptions_handler section
-    # if page > total_pages:
-    #     raise NotFound('Page')
-    skip = (page - 1) * page_size
-    products = db.query(Product).offset(skip).limit(page_size).all()
-    return products
+def list_products(response: Response, page: int = Query(1, gt=0), page_size: int = Query(10, gt=0), cursor: Optional[str] = None,
+                  include_total: bool = False, brand: Optional[str] = None, min_price: Optional[float] = None,
+                  max_price: Optional[float] = None, min_review_score: Optional[float] = None, title: Optional[str] = None,
+                  title_prefix: Optional[str] = None, sort_by: ProductSort = 'id', order: SortOrder = 'asc',
+                  db: Session = Depends(get_db)) -> List[Product]:
+    filters = product_filters(brand, min_price, max_price, min_review_score, title, title_prefix)
+    # the id breaks ties, so the order (and the cursor) is stable whatever the sort column
+    sort_columns = (Product.id,) if sort_by == 'id' else (getattr(Product, sort_by), Product.id)
+    descending = order == 'desc'
+    # price and review_score may be NULL: sorted as the largest value on every backend (sqlite defaults to the smallest)
+    order_by = [column.desc() if descending else column for column in sort_columns]
+    if sort_by != 'id':
+        order_by[0] = order_by[0].nulls_first() if descending else order_by[0].nulls_last()
+    statement = select(Product).where(*filters).order_by(*order_by)
+
+    # the cursor takes precedence over page and seeks on the sort columns (see the ix_product_* indexes)
+    sort_tag = f'{sort_by}:{order}'
+    if cursor is not None:
+        value_parsers = (int,) if sort_by == 'id' else (cursor_decimal, int)
+        _, *values = decode_cursor(cursor, cursor_tag(sort_tag), *value_parsers)
+        if sort_by == 'id':
+            statement = statement.where(seek_after(sort_columns, values, descending))
+        else:
+            if values[0] is not None:
+                # seek from the value stored in the last row: the one in the cursor went through a float
+                # or a Decimal cut to the column scale and may sort before it (e.g. 1/3), which would serve
+                # the same page again; it only stands in when that row is gone
+                stored = select(sort_columns[0]).where(Product.id == values[1]).correlate(None).scalar_subquery()
+                values[0] = func.coalesce(stored, values[0])
+            statement = statement.where(seek_after_nullable(sort_columns, values, descending))
+    else:
+        statement = statement.offset((page - 1) * page_size)
+    statement = statement.limit(page_size)
+
+    # fast path: plain rows dumped by orjson, no ORM objects and no per-row pydantic validation
+    if settings.FAST_READS:
+        products = db.execute(statement.with_only_columns(*PRODUCT_COLUMNS, Product.updated_at)).all()
+        response = ORJSONResponse([product_row(row) for row in products])
+    else:
+        products = db.scalars(statement).all()
+
+    # the total is opt-in and comes from a cached count (or the planner estimate on postgres),
+    # see SOLARIS_ROW_COUNT_MAX_AGE for how stale it may get; filtered totals are always counted
+    if include_total:
+        if filters:
+            total_items = db.scalar(select(func.count()).select_from(Product).where(*filters))
+        else:
+            total_items = row_count(db, Product.__table__)
+        response.headers[TOTAL_COUNT_HEADER] = str(total_items)
+        response.headers[TOTAL_PAGES_HEADER] = str((total_items + page_size - 1) // page_size)
+
+    if len(products) == page_size:
+        last = products[-1]
+        if sort_by == 'id':
+            values = [last.id]
+        else:
+            value = getattr(last, sort_by)
+            values = [None if value is None else str(value), last.id]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(sort_tag, *values)
+    set_last_modified(response, products)
+
+    return response if settings.FAST_READS else products
+
+# ranked by the denormalized favorite_count, a backwards scan of ix_product_favorite_count_id
+@router.get("/top", response_model=List[TopProductResponse])
+def top_products(limit: int = Query(10, gt=0, le=100), db: Session = Depends(get_db)) -> List[Product]:
+    statement = select(Product).order_by(Product.favorite_count.desc(), Product.id.desc()).limit(limit)
+
+    if settings.FAST_READS:
+        products = db.execute(statement.with_only_columns(*PRODUCT_COLUMNS, Product.favorite_count)).all()
+        return ORJSONResponse([{**product_row(row), 'favorite_count': row.favorite_count} for row in products])
+
+    return db.scalars(statement).all()
 
 @router.get("/{id_product}", response_model=ProductResponse)
-def product_by_id(id_product: int, db: Session = Depends(get_db)) -> ProductResponse:
-    product: Product = db.query(Product).get(id_product)
+def product_by_id(id_product: int, request: Request, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> ProductResponse:
+    key = product_key(id_product)
+    entry = cache.get(key)
 
-    if product is None:
+    if entry is None:
+        lease = cache.lease(key)
+        product: Product = db.query(Product).get(id_product)
+
+        if product is None:
+            raise NotFound('Product')
+
+        # the caller already has this version, don't bother serializing it
+        etag = row_etag(product)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        entry = cache_entry(etag, ProductResponse.model_validate(product, from_attributes=True).model_dump_json().encode())
+        cache.fill(key, entry, lease)
+
+    return conditional_response(request, entry)
+
+# top pairs of the co-favorite index, a single range scan of ix_product_co_favorite_product_id_count
+@router.get("/{id_product}/related", response_model=List[RelatedProductResponse])
+def related_products(id_product: int, limit: int = Query(10, gt=0, le=100), db: Session = Depends(get_db)) -> ORJSONResponse:
+    rows = db.execute(select(*PRODUCT_COLUMNS, product_co_favorite.c.count)
+                      .join(product_co_favorite, product_co_favorite.c.related_id == Product.id)
+                      .where(product_co_favorite.c.product_id == id_product, product_co_favorite.c.count > 0)
+                      .order_by(product_co_favorite.c.count.desc(), product_co_favorite.c.related_id.desc())
+                      .limit(limit)).all()
+
+    if not rows and db.scalar(select(Product.id).where(Product.id == id_product)) is None:
         raise NotFound('Product')
-    
-    return product
 
-@router.delete("/delete/{id_product}", status_code=204)
-def delete_product(id_product: int, db: Session = Depends(get_db)) -> None:
+    return ORJSONResponse([{**product_row(row), 'co_favorites': row.count} for row in rows])
+
+def apply_product_delete(id_product: int, db: Session) -> List[int]:
+    # everything but the commit, returns the clients whose cached payload embeds the product
     product: Product = db.query(Product).get(id_product)
 
     if product is None:
         raise NotFound('Product')
-    
+
+    # its favorite_count goes away with the row, no other count changes
+    id_clients = db.scalars(select(client_product.c.client_id).where(client_product.c.product_id == id_product)).all()
+
+    db.execute(delete(product_co_favorite).where(or_(product_co_favorite.c.product_id == id_product,
+                                                     product_co_favorite.c.related_id == id_product)))
     db.delete(product)
+    if id_clients:
+        touch_clients(id_clients, db)
+    return id_clients
+
+def product_delete_job(db: Session, id_product: int, payload: Dict[str, Any]) -> List[str]:
+    id_clients = apply_product_delete(id_product, db)
+    # a batch rolled back leaves the cached count off by one until it gets stale
+    adjust_row_count(db, Product.__table__, -1)
+    return [product_key(id_product), *(client_key(id_client) for id_client in id_clients)]
+
+job_queue.register('product_delete', product_delete_job)
+
+@router.delete("/delete/{id_product}", status_code=204, response_model=None)
+def delete_product(id_product: int, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> Optional[Response]:
+    # unlinking a product favorited by many clients runs in the background, see SOLARIS_BACKGROUND_WRITES
+    if settings.BACKGROUND_WRITES:
+        if db.scalar(select(Product.id).where(Product.id == id_product)) is None:
+            raise NotFound('Product')
+        return accepted(job_queue.submit(db, 'product_delete', id_product, {}))
+
+    id_clients = apply_product_delete(id_product, db)
     db.commit()
+    adjust_row_count(db, Product.__table__, -1)
+    cache.delete(product_key(id_product), *(client_key(id_client) for id_client in id_clients))
 
 @router.post("/register", response_model=ProductResponse, status_code=201)
-def register_product(product_request: ProductRequest, db: Session = Depends(get_db)):
+def register_product(product_request: ProductRequest, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)):
     new_product = Product(**product_request.dict())
     db.add(new_product)
     db.commit()
     db.refresh(new_product)
+    adjust_row_count(db, Product.__table__, 1)
+    # ids can be handed out again (e.g. sqlite reuses the highest one after it is deleted)
+    cache.delete(product_key(new_product.id))
+
+    return new_product
+
+def parse_bulk_row(line: bytes, csv_header: Optional[List[str]]) -> Dict[str, Any]:
+    text = line.decode('utf-8')
+
+    if csv_header is None:
+        row = json.loads(text)
+        if not isinstance(row, dict):
+            raise ValueError('Expected a JSON object.')
+        return row
+
+    values = next(csv.reader([text]))
+    if len(values) != len(csv_header):
+        raise ValueError(f'Expected {len(csv_header)} columns, got {len(values)}.')
+    return dict(zip(csv_header, values))
+
+def insert_products(rows: List[Dict[str, Any]], db: Session) -> List[int]:
+    try:
+        ids = db.scalars(insert(Product).returning(Product.id), rows).all()
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+
+    return ids
+
+# NDJSON (one ProductRequest per line) or CSV with a header row. The body is read as it arrives
+# and inserted in chunks of SOLARIS_BULK_CHUNK_SIZE rows, one transaction each, so memory
+# stays flat whatever the size of the upload.
+@router.post("/bulk", response_model=BulkImportResponse)
+async def bulk_register_products(request: Request, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)) -> BulkImportResponse:
+    is_csv = 'csv' in request.headers.get('content-type', '')
+    csv_header: Optional[List[str]] = None
+    report = BulkImportResponse(inserted=0, failed=0, errors=[])
+    chunk: List[Dict[str, Any]] = []
+    chunk_lines: List[int] = []
+
+    def fail(line: int, detail: List[Dict[str, Any]]) -> None:
+        report.failed += 1
+        if len(report.errors) < settings.BULK_MAX_REPORTED_ERRORS:
+            report.errors.append(BulkImportError(line=line, detail=detail))
+
+    async def flush() -> None:
+        try:
+            ids = await run_in_threadpool(insert_products, chunk, db)
+        except SQLAlchemyError as e:
+            for line in chunk_lines:
+                fail(line, [{'loc': [], 'msg': f'Insert failed: {e.__class__.__name__}.'}])
+        else:
+            report.inserted += len(ids)
+            adjust_row_count(db, Product.__table__, len(ids))
+            cache.delete(*(product_key(id_product) for id_product in ids))
+
+        chunk.clear()
+        chunk_lines.clear()
+
+    async for number, line in stream_lines(request):
+        if not line.strip():
+            continue
+
+        try:
+            if is_csv and csv_header is None:
+                csv_header = next(csv.reader([line.decode('utf-8')]))
+                continue
+            row = ProductRequest(**parse_bulk_row(line, csv_header)).model_dump()
+        except ValidationError as e:
+            fail(number, [{'loc': list(error['loc']), 'msg': error['msg']} for error in e.errors()])
+        except ValueError as e:
+            fail(number, [{'loc': [], 'msg': str(e)}])
+        else:
+            chunk.append(row)
+            chunk_lines.append(number)
+            if len(chunk) >= settings.BULK_CHUNK_SIZE:
+                await flush()
+
+    if chunk:
+        await flush()
 
-    return new_product
\ No newline at end of file
+    return report
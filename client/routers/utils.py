@@ -1,11 +1,228 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from typing import Any, AsyncIterator, Callable, Iterable, List, Optional, Sequence, Tuple
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import ColumnElement, Insert, Integer, Table, and_, delete, func, insert, literal, or_, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from client.models.client_model import Client
-from shared.exceptions import NotFound
+from client.models.client_model import Client, client_product
+from client.models.product_model import Product, product_co_favorite
+from shared.exceptions import InvalidCursor, NotFound
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+TOTAL_COUNT_HEADER = 'X-Total-Count'
+TOTAL_PAGES_HEADER = 'X-Total-Pages'
 
 def search_client_by_id(id_client: int, db: Session) -> Client:
     client: Client = db.query(Client).get(id_client)
 
     if client is None:
         raise NotFound('Client')
-    
-    return client        
\ No newline at end of file
+
+    return client
+
+def accepted(id_job: int) -> Response:
+    # the mutation is queued, its outcome is at /jobs/{id}
+    return JSONResponse({'id': id_job, 'status': 'pending'}, status_code=202, headers={'Location': f'/jobs/{id_job}'})
+
+def row_etag(row: Any) -> str:
+    # the version alone repeats when a deleted row's id is handed out again
+    updated_at = int(row.updated_at.timestamp() * 1_000_000) if row.updated_at else 0
+    return f'W/"{row.version}-{updated_at:x}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag})
+
+# cached payloads carry their etag on the first line
+def cache_entry(etag: str, payload: bytes) -> bytes:
+    return etag.encode() + b'\n' + payload
+
+def conditional_response(request: Request, entry: bytes) -> Response:
+    etag, payload = entry.split(b'\n', 1)
+    etag = etag.decode()
+
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    return Response(payload, media_type='application/json', headers={'ETag': etag})
+
+def set_last_modified(response: Response, rows: Iterable[Any]) -> None:
+    updated_at = [row.updated_at for row in rows if row.updated_at is not None]
+    if updated_at:
+        response.headers['Last-Modified'] = format_datetime(max(updated_at).astimezone(timezone.utc), usegmt=True)
+
+def touch_clients(id_clients: Iterable[int], db: Session) -> None:
+    # changes to the association don't update the client row, bump its version by hand
+    db.execute(update(Client).where(Client.id.in_(set(id_clients))).values(updated_at=datetime.now()))
+
+def adjust_favorite_counts(product_ids: Iterable[int], db: Session, sign: int = 1) -> None:
+    # one UPDATE per distinct delta; updated_at/version are kept as they are since
+    # the count is not part of the product payload and shouldn't invalidate its ETag
+    by_delta = {}
+    for product_id, count in Counter(product_ids).items():
+        by_delta.setdefault(sign * count, []).append(product_id)
+
+    for delta, ids in by_delta.items():
+        db.execute(update(Product).where(Product.id.in_(ids))
+                   .values(favorite_count=Product.favorite_count + delta, updated_at=Product.updated_at, version=Product.version))
+
+def dialect_insert(db: Session, table: Table) -> Optional[Insert]:
+    # INSERT supporting ON CONFLICT, None on backends without it
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    return None
+
+def adjust_co_favorites(id_clients: Iterable[int], product_ids: Optional[Iterable[int]], db: Session, sign: int = 1) -> None:
+    # pairs among the clients' current favorites that involve product_ids (every pair when None):
+    # run after adding favorites (sign=1) and before removing them (sign=-1), one statement whatever the sizes
+    statement = dialect_insert(db, product_co_favorite)
+    if statement is None:
+        # other backends only get the periodic rebuild (client/jobs/co_favorites.py)
+        return
+
+    first, second = client_product.alias(), client_product.alias()
+    favorites = first.join(second, and_(second.c.client_id == first.c.client_id, second.c.product_id != first.c.product_id))
+    in_clients = first.c.client_id.in_(set(id_clients))
+    if product_ids is None:
+        pairs = select(first.c.product_id, second.c.product_id.label('related_id')).select_from(favorites).where(in_clients)
+    else:
+        # driven from the changed ids (the primary key finds them), each joined with the client's other
+        # favorites: O(changed * favorites) rather than every pair of favorites. The mirrored pairs come
+        # from the same rows, except the ones inside the changed set which the first select has both ways
+        product_ids = set(product_ids)
+        changed = and_(in_clients, first.c.product_id.in_(product_ids))
+        pairs = union_all(
+            select(first.c.product_id, second.c.product_id.label('related_id')).select_from(favorites).where(changed),
+            select(second.c.product_id, first.c.product_id).select_from(favorites).where(changed, second.c.product_id.not_in(product_ids)),
+        )
+    pairs = pairs.subquery()
+    counts = select(pairs.c.product_id, pairs.c.related_id, sign * func.count()).group_by(pairs.c.product_id, pairs.c.related_id)
+    statement = statement.from_select(['product_id', 'related_id', 'count'], counts)
+
+    db.execute(statement.on_conflict_do_update(index_elements=['product_id', 'related_id'],
+                                               set_={'count': product_co_favorite.c.count + statement.excluded.count}))
+
+def add_favorites(id_client: int, product_ids: Iterable[int], db: Session) -> List[int]:
+    # INSERT ... SELECT over the existing products, so unknown ids are skipped
+    # and pairs already in the association are left alone by the database
+    products = select(literal(id_client, Integer), Product.id).where(Product.id.in_(set(product_ids)))
+    statement = dialect_insert(db, client_product)
+    if statement is not None:
+        statement = statement.on_conflict_do_nothing()
+    else:
+        current = select(client_product.c.product_id).where(client_product.c.client_id == id_client)
+        statement = insert(client_product)
+        products = products.where(Product.id.not_in(current))
+
+    # RETURNING only reports the pairs actually inserted
+    added = db.scalars(statement.from_select(['client_id', 'product_id'], products).returning(client_product.c.product_id)).all()
+    if added:
+        adjust_favorite_counts(added, db)
+        adjust_co_favorites([id_client], added, db)
+    return added
+
+def remove_favorites(id_client: int, product_ids: Iterable[int], db: Session) -> List[int]:
+    product_ids = set(product_ids)
+    adjust_co_favorites([id_client], product_ids, db, -1)
+    removed = db.scalars(delete(client_product).where(client_product.c.client_id == id_client,
+                                                      client_product.c.product_id.in_(product_ids))
+                         .returning(client_product.c.product_id)).all()
+    adjust_favorite_counts(removed, db, -1)
+    return removed
+
+def clear_favorites(id_clients: Iterable[int], db: Session) -> List[int]:
+    # every favorite of the given clients, run before deleting them so the counts follow
+    id_clients = set(id_clients)
+    adjust_co_favorites(id_clients, None, db, -1)
+    removed = db.scalars(delete(client_product).where(client_product.c.client_id.in_(id_clients))
+                         .returning(client_product.c.product_id)).all()
+    adjust_favorite_counts(removed, db, -1)
+    return removed
+
+async def stream_lines(request: Request) -> AsyncIterator[Tuple[int, bytes]]:
+    # yields (line number, line) while the body is still being received
+    number = 0
+    pending = b''
+    async for chunk in request.stream():
+        *lines, pending = (pending + chunk).split(b'\n')
+        for line in lines:
+            number += 1
+            yield number, line.rstrip(b'\r')
+
+    if pending:
+        yield number + 1, pending.rstrip(b'\r')
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps(values, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str, *parsers: Callable[[Any], Any]) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(parsers):
+            raise ValueError(cursor)
+        return [parse(value) for parse, value in zip(parsers, values)]
+    except (binascii.Error, TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+def cursor_decimal(value: Any) -> Optional[Decimal]:
+    # parser for a numeric cursor value, None when the row had none; Decimal raises InvalidOperation
+    # (an ArithmeticError) on garbage, and NaN or Infinity can't be compared with
+    if value is None:
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+    if not number.is_finite():
+        raise ValueError(value)
+    return number
+
+def cursor_tag(expected: str) -> Callable[[Any], str]:
+    # parser for a cursor value that must match the current request (e.g. its sort order)
+    def parse(value: Any) -> str:
+        if value != expected:
+            raise ValueError(value)
+        return value
+
+    return parse
+
+def seek_after(columns: Sequence[Any], values: Sequence[Any], descending: bool = False) -> ColumnElement:
+    # rows coming after `values` in ORDER BY columns, written as nested OR/AND (rather than a
+    # row value comparison) so every backend can use the matching composite index
+    column, value = columns[0], values[0]
+    after = column < value if descending else column > value
+    if len(columns) == 1:
+        return after
+
+    return or_(after, and_(column == value, seek_after(columns[1:], values[1:], descending)))
+
+def seek_after_nullable(columns: Sequence[Any], values: Sequence[Any], descending: bool = False) -> ColumnElement:
+    # seek_after for a nullable first column sorted with NULL as the largest value (NULLS LAST ascending,
+    # NULLS FIRST descending, the postgres default, so its indexes still serve the order)
+    column, value = columns[0], values[0]
+    if value is None:
+        after_nulls = and_(column.is_(None), seek_after(columns[1:], values[1:], descending))
+        return or_(column.is_not(None), after_nulls) if descending else after_nulls
+
+    after = seek_after(columns, values, descending)
+    return after if descending else or_(after, column.is_(None))
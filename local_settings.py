@@ -0,0 +1,2 @@
+DB_USERNAME = "u"
+DB_PASSWORD = "p"
@@ -1,19 +1,111 @@
-import uvicorn
+import argparse
+import os
+import sys
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
 from fastapi import FastAPI
-from client.routers import client_router, product_router
-from shared.exceptions import NotFound
-from shared.exceptions_handler import not_found_exception_handler
-# from shared.database import engine, Base
-# from client.models.client_model import Client
+from starlette.concurrency import run_in_threadpool
+from shared import settings
 
-# Base.metadata.drop_all(bind=engine)
-# Base.metadata.create_all(bind=engine)
+# The schema is managed by the migrations (alembic upgrade head, see migrations/).
 
-app = FastAPI()
+# Importing this module is cheap: the routers (and the models behind them) are imported by
+# create_app, the engines are created on first use and uvicorn only when serving.
 
-app.include_router(client_router.router)
-app.include_router(product_router.router)
-app.add_exception_handler(NotFound, not_found_exception_handler)
+def _lifespan(async_db: bool):
+    from client.jobs.queue import job_queue
+    from shared.database import dispose_engines, get_async_engine, get_engine
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if settings.DB_WARMUP:
+            # pay for the engine and the first connection before the first request arrives
+            if async_db:
+                async with get_async_engine().connect():
+                    pass
+            else:
+                await run_in_threadpool(lambda: get_engine().connect().close())
+        if settings.BACKGROUND_WRITES:
+            # the jobs a previous process left pending
+            job_queue.start()
+        yield
+        # graceful shutdown: uvicorn has drained the requests, let the background writes finish
+        # (see SOLARIS_SERVER_GRACEFUL_TIMEOUT) and close this worker's pooled connections
+        await run_in_threadpool(job_queue.wait, settings.SERVER_GRACEFUL_TIMEOUT)
+        await dispose_engines()
+
+    return lifespan
+
+def create_app(async_db: Optional[bool] = None) -> FastAPI:
+    from client.routers import client_router, job_router, product_router
+    from shared import metrics
+    from shared.async_router import make_async_router
+    from shared.exceptions import InvalidCursor, NotFound
+    from shared.exceptions_handler import invalid_cursor_exception_handler, not_found_exception_handler
+    from shared.http_cache import HttpCacheMiddleware
+    from shared.load_shedding import LoadSheddingMiddleware
+    from shared.request_metrics import RequestMetricsMiddleware
+
+    async_db = settings.DB_ASYNC if async_db is None else async_db
+    app = FastAPI(lifespan=_lifespan(async_db))
+
+    for router in (client_router.router, product_router.router, job_router.router):
+        app.include_router(make_async_router(router) if async_db else router)
+    app.include_router(metrics.router)
+    # compression, Cache-Control and the cache of the first list pages, closest to the routes
+    app.add_middleware(HttpCacheMiddleware)
+    # rate limit and per-route concurrency caps; added before the metrics so it runs inside them,
+    # which then also see the queue wait and the rejected requests
+    app.add_middleware(LoadSheddingMiddleware, routes=app.routes)
+    # latency and SQL statements per route, reported on /metrics (and Server-Timing when enabled)
+    app.add_middleware(RequestMetricsMiddleware)
+
+    app.add_exception_handler(NotFound, not_found_exception_handler)
+    app.add_exception_handler(InvalidCursor, invalid_cursor_exception_handler)
+
+    return app
+
+_app: Optional[FastAPI] = None
+
+def __getattr__(name: str) -> Any:
+    # main.app (uvicorn main:app, the tests) is built on first access, see PEP 562
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def server_options(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description='Serve the API with uvicorn, defaults come from the SOLARIS_SERVER_* variables.')
+    parser.add_argument('--host', default=settings.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=settings.SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=settings.SERVER_WORKERS)
+    parser.add_argument('--keep-alive', type=int, default=settings.SERVER_KEEP_ALIVE, help='seconds an idle connection is kept open')
+    parser.add_argument('--backlog', type=int, default=settings.SERVER_BACKLOG, help='pending connections queued by the socket')
+    parser.add_argument('--graceful-timeout', type=int, default=settings.SERVER_GRACEFUL_TIMEOUT)
+    parser.add_argument('--access-log', action=argparse.BooleanOptionalAction, default=settings.SERVER_ACCESS_LOG)
+    args = parser.parse_args(argv)
+
+    # the factory rather than an app object: every worker builds its own app after the fork
+    # and creates its own engine on the first request (see shared.database.get_engine)
+    return {'app': 'main:create_app', 'factory': True, 'host': args.host, 'port': args.port, 'workers': args.workers,
+            # auto picks uvloop and httptools when they are installed, asyncio and h11 otherwise
+            'loop': 'auto', 'http': 'auto',
+            'timeout_keep_alive': args.keep_alive, 'backlog': args.backlog,
+            'timeout_graceful_shutdown': args.graceful_timeout, 'access_log': args.access_log}
+
+def configure_workers(workers: int) -> None:
+    # the workers read their settings from the environment when they start: with several of them an
+    # in-process cache would only be invalidated by the writes of its own worker and keep serving
+    # stale payloads to the others, so it is turned off unless a shared backend (redis) is set
+    if workers > 1 and settings.CACHE_BACKEND == 'memory':
+        os.environ['SOLARIS_CACHE_BACKEND'] = 'none'
+        print(f'{workers} workers with the memory cache, caching is disabled (set SOLARIS_CACHE_BACKEND=redis to share one)',
+              file=sys.stderr)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=3030)
\ No newline at end of file
+    import uvicorn
+    options = server_options()
+    configure_workers(options['workers'])
+    uvicorn.run(**options)
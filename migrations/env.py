@@ -0,0 +1,43 @@
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import create_engine, pool
+from shared import settings
+from shared.database import Base
+# every model, for autogenerate to compare the whole schema
+from client.models import client_model, job_model, product_model
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+def database_url() -> str:
+    # alembic -x url=... (or sqlalchemy.url set by a caller) overrides the settings
+    return context.get_x_argument(as_dictionary=True).get('url') or config.get_main_option('sqlalchemy.url') or settings.database_url()
+
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    # autogenerate ignores ddl_if, leave out the indexes of other backends (e.g. the trigram one)
+    ddl_if = getattr(object, '_ddl_if', None)
+    return ddl_if is None or ddl_if.dialect is None or ddl_if.dialect == context.get_context().dialect.name
+
+def run_migrations_offline() -> None:
+    # alembic upgrade head --sql prints the statements instead of running them
+    context.configure(url=database_url(), target_metadata=target_metadata, literal_binds=True,
+                      dialect_opts={'paramstyle': 'named'}, include_object=include_object, transaction_per_migration=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online() -> None:
+    engine = create_engine(database_url(), poolclass=pool.NullPool)
+    with engine.connect() as connection:
+        # one transaction per revision, the index revisions step out of it for CREATE INDEX CONCURRENTLY
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object,
+                          transaction_per_migration=True)
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,24 @@
+from typing import Any, List
+from alembic import op
+
+# Index revisions run against live tables: on postgres the indexes are built with CREATE INDEX
+# CONCURRENTLY, which doesn't block the writes but can't run inside a transaction, hence the
+# autocommit block. A concurrent build that fails (e.g. duplicates under a unique index) leaves
+# an INVALID index behind: drop it, fix the data and run the upgrade again.
+
+def _postgresql() -> bool:
+    return op.get_context().dialect.name == 'postgresql'
+
+def create_index(name: str, table: str, columns: List[str], **kwargs: Any) -> None:
+    if _postgresql():
+        with op.get_context().autocommit_block():
+            op.create_index(name, table, columns, postgresql_concurrently=True, **kwargs)
+    else:
+        op.create_index(name, table, columns, **kwargs)
+
+def drop_index(name: str, table: str) -> None:
+    if _postgresql():
+        with op.get_context().autocommit_block():
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    else:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,50 @@
+"""baseline: the schema Base.metadata.create_all used to build
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('client',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('email', sa.String(length=50), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table('product',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('price', sa.Numeric(), nullable=True),
+        sa.Column('image', sa.String(length=50), nullable=True),
+        sa.Column('brand', sa.String(length=50), nullable=True),
+        sa.Column('title', sa.String(length=50), nullable=True),
+        sa.Column('review_score', sa.Numeric(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table('client_product',
+        sa.Column('client_id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['client_id'], ['client.id']),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id']),
+        sa.PrimaryKeyConstraint('client_id', 'product_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('client_product')
+    op.drop_table('product')
+    op.drop_table('client')
@@ -0,0 +1,64 @@
+"""row versions, favorite counts, the co-favorite index and the job table
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:02:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # server defaults: the existing rows get their value without a table rewrite on postgres 11+
+    op.add_column('client', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('client', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('product', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('product', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('product', sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+
+    # the counts of the favorites already there, as client/jobs/favorite_counts.py computes them
+    op.execute('UPDATE product SET favorite_count = (SELECT count(*) FROM client_product WHERE client_product.product_id = product.id) '
+               'WHERE EXISTS (SELECT 1 FROM client_product WHERE client_product.product_id = product.id)')
+
+    # starts empty, built from the existing favorites by python -m client.jobs.co_favorites
+    op.create_table('product_co_favorite',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('related_id', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id']),
+        sa.ForeignKeyConstraint(['related_id'], ['product.id']),
+        sa.PrimaryKeyConstraint('product_id', 'related_id'),
+    )
+    op.create_table('job',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('target_id', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('error', sa.String(length=200), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('job')
+    op.drop_table('product_co_favorite')
+    with op.batch_alter_table('product') as batch:
+        batch.drop_column('favorite_count')
+        batch.drop_column('version')
+        batch.drop_column('updated_at')
+    with op.batch_alter_table('client') as batch:
+        batch.drop_column('version')
+        batch.drop_column('updated_at')
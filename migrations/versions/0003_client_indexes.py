@@ -0,0 +1,28 @@
+"""client indexes: keyset pagination of /client/list and unique emails
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from migrations.indexes import create_index, drop_index
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    create_index('ix_client_created_at_id', 'client', ['created_at', 'id'])
+    # fails on a table already holding duplicate emails, they have to be merged first
+    create_index('ix_client_email', 'client', ['email'], unique=True)
+
+
+def downgrade() -> None:
+    drop_index('ix_client_email', 'client')
+    drop_index('ix_client_created_at_id', 'client')
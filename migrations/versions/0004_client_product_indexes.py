@@ -0,0 +1,26 @@
+"""client_product reverse lookup: the clients of a product
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 10:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from migrations.indexes import create_index, drop_index
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the primary key starts with client_id, deleting a product looked its clients up with a full scan
+    create_index('ix_client_product_product_id', 'client_product', ['product_id'])
+
+
+def downgrade() -> None:
+    drop_index('ix_client_product_product_id', 'client_product')
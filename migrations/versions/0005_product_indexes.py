@@ -0,0 +1,43 @@
+"""product indexes: filters and sort orders of /product/list, /product/top and /product/{id}/related
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 10:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from migrations.indexes import create_index, drop_index
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    create_index('ix_product_brand_id', 'product', ['brand', 'id'])
+    create_index('ix_product_price_id', 'product', ['price', 'id'])
+    create_index('ix_product_review_score_id', 'product', ['review_score', 'id'])
+    create_index('ix_product_favorite_count_id', 'product', ['favorite_count', 'id'])
+    create_index('ix_product_co_favorite_product_id_count', 'product_co_favorite', ['product_id', 'count', 'related_id'])
+
+    # title substring/prefix search (ILIKE '%...%'), postgres only
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        create_index('ix_product_title_trgm', 'product', ['title'], postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        drop_index('ix_product_title_trgm', 'product')
+
+    drop_index('ix_product_co_favorite_product_id_count', 'product_co_favorite')
+    drop_index('ix_product_favorite_count_id', 'product')
+    drop_index('ix_product_review_score_id', 'product')
+    drop_index('ix_product_price_id', 'product')
+    drop_index('ix_product_brand_id', 'product')
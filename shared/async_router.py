@@ -0,0 +1,62 @@
+import inspect
+from functools import wraps
+from typing import Any, Callable, Dict
+from fastapi import APIRouter, Depends, Response
+from fastapi.params import Depends as DependsParam
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+from shared.dependencies import get_async_db, get_db
+
+# The async stack reuses the sync handlers as they are: each one runs inside
+# AsyncSession.run_sync, which drives the ORM on the async driver through a
+# greenlet on the event loop, so no request ever waits for a threadpool slot.
+
+def _db_parameter(endpoint: Callable) -> str:
+    for name, parameter in inspect.signature(endpoint).parameters.items():
+        if isinstance(parameter.default, DependsParam) and parameter.default.dependency is get_db:
+            return name
+
+def _asyncify(endpoint: Callable, db_parameter: str, response_model: Any) -> Callable:
+    adapter = TypeAdapter(response_model) if response_model is not None else None
+
+    def call(db: Session, kwargs: Dict[str, Any]) -> Any:
+        result = endpoint(**kwargs, **{db_parameter: db})
+        # validate here, while lazy loads can still reach the database
+        if adapter is None or isinstance(result, Response):
+            return result
+        return adapter.validate_python(result, from_attributes=True)
+
+    @wraps(endpoint)
+    async def async_endpoint(**kwargs: Any) -> Any:
+        db = kwargs.pop(db_parameter)
+        return await db.run_sync(call, kwargs)
+
+    signature = inspect.signature(endpoint)
+    async_endpoint.__signature__ = signature.replace(parameters=[
+        parameter.replace(default=Depends(get_async_db)) if name == db_parameter else parameter
+        for name, parameter in signature.parameters.items()
+    ])
+
+    return async_endpoint
+
+def make_async_router(router: APIRouter) -> APIRouter:
+    async_router = APIRouter()
+
+    for route in router.routes:
+        if not isinstance(route, APIRoute):
+            async_router.routes.append(route)
+            continue
+
+        endpoint = route.endpoint
+        db_parameter = _db_parameter(endpoint)
+        # handlers that are async already (e.g. streaming uploads) keep their sync session,
+        # they only touch it through run_in_threadpool
+        if db_parameter is not None and not inspect.iscoroutinefunction(endpoint):
+            endpoint = _asyncify(endpoint, db_parameter, route.response_model)
+
+        async_router.add_api_route(route.path, endpoint, methods=route.methods, name=route.name,
+                                   status_code=route.status_code, response_model=route.response_model,
+                                   response_class=route.response_class, tags=route.tags)
+
+    return async_router
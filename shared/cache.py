@@ -0,0 +1,165 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+from shared import metrics, settings
+
+MARK_PREFIX = 'mark:'
+
+class Cache:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._get(key)
+        # plain increments, an occasional lost update is fine for a counter
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    # A reader that loaded a row before a write committed must not put it back after the writer's delete:
+    # every delete also leaves a mark, the reader takes the key's mark before reading the database (lease)
+    # and drops what it stored if the mark changed by then (fill).
+
+    def peek(self, key: str) -> Optional[bytes]:
+        # a bookkeeping read (e.g. the response cache generation), left out of the hit and miss counters
+        return self._get(key)
+
+    def lease(self, key: str) -> Optional[bytes]:
+        return self._get(MARK_PREFIX + key)
+
+    def fill(self, key: str, value: bytes, lease: Optional[bytes]) -> None:
+        self.set(key, value)
+        if self._get(MARK_PREFIX + key) != lease:
+            self._delete(key)
+
+    def delete(self, *keys: str) -> None:
+        # marked before the delete: a fill that came in between sees the new mark
+        self._set_many({MARK_PREFIX + key: uuid4().bytes for key in keys})
+        self._delete(*keys)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def _set_many(self, values: Dict[str, bytes]) -> None:
+        for key, value in values.items():
+            self.set(key, value)
+
+    def _delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+class NullCache(Cache):
+    def _get(self, key: str) -> Optional[bytes]:
+        return None
+
+    def set(self, key: str, value: bytes) -> None:
+        pass
+
+    def _delete(self, *keys: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+class MemoryCache(Cache):
+    # per process LRU, entries also expire after ttl seconds
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[float, bytes]]' = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+class RedisCache(Cache):
+    # works with any client exposing the redis-py get/set/delete/scan_iter methods
+    def __init__(self, client: Any, ttl: float, prefix: str = 'solaris:'):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.client.set(self.prefix + key, value, ex=max(int(self.ttl), 1))
+
+    def _set_many(self, values: Dict[str, bytes]) -> None:
+        # one round trip for the marks of a bulk write
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.set(self.prefix + key, value, ex=max(int(self.ttl), 1))
+        pipeline.execute()
+
+    def _delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+def product_key(id_product: int) -> str:
+    return f'product:{id_product}'
+
+def client_key(id_client: int) -> str:
+    return f'client:{id_client}'
+
+def create_cache() -> Cache:
+    if settings.CACHE_BACKEND == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(settings.CACHE_REDIS_URL), settings.CACHE_TTL)
+    if settings.CACHE_BACKEND == 'memory':
+        return MemoryCache(settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL)
+    return NullCache()
+
+cache = create_cache()
+
+def current_cache() -> Cache:
+    # read at each use, so the routes (see shared.dependencies.get_cache), the response cache and the
+    # job worker all reach the same one, also when a test swaps it
+    return cache
+
+def _cache_lines() -> List[str]:
+    return [f'solaris_cache_hits_total {current_cache().hits}',
+            f'solaris_cache_misses_total {current_cache().misses}']
+
+metrics.register_collector(_cache_lines)
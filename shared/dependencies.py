@@ -1,8 +1,20 @@
-from shared.database import SessionLocal
+from shared.cache import Cache, current_cache
+from shared.database import AsyncSessionLocal, SessionLocal, get_async_engine, get_engine
 
 def get_db():
-    db = SessionLocal()
+    db = SessionLocal(bind=get_engine())
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    db = AsyncSessionLocal(bind=get_async_engine())
+    try:
+        yield db
+    finally:
+        await db.close()
+
+# async: nothing to wait for, so no threadpool hop for it on every request
+async def get_cache() -> Cache:
+    return current_cache()
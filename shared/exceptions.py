@@ -1,3 +1,7 @@
 class NotFound(Exception):
     def __init__(self, name: str):
         self.name = name
+
+class InvalidCursor(Exception):
+    def __init__(self, cursor: str):
+        self.cursor = cursor
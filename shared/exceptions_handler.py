@@ -1,6 +1,9 @@
 from fastapi import Request
 from fastapi.responses import JSONResponse
-from shared.exceptions import NotFound
+from shared.exceptions import InvalidCursor, NotFound
 
 async def not_found_exception_handler(request: Request, exc: NotFound):
-    return JSONResponse(status_code=404, content={'detail': f'{exc.name} not found.'})
\ No newline at end of file
+    return JSONResponse(status_code=404, content={'detail': f'{exc.name} not found.'})
+
+async def invalid_cursor_exception_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(status_code=400, content={'detail': 'Invalid cursor.'})
@@ -0,0 +1,207 @@
+import gzip
+import json
+import zlib
+from importlib.util import find_spec
+from typing import Dict, Optional
+from uuid import uuid4
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from starlette.routing import BaseRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from shared import settings
+from shared.cache import current_cache
+
+# Compression and HTTP caching of the responses:
+# - bodies of SOLARIS_COMPRESSION_MIN_SIZE bytes or more go out with brotli (when the brotli package is
+#   installed) or gzip, whichever the client accepts; streamed responses are compressed chunk by chunk
+# - SOLARIS_CACHE_CONTROL sets the Cache-Control header of the routes it lists
+# - the first pages of SOLARIS_RESPONSE_CACHE_ROUTES are kept in the cache as sent, already compressed,
+#   so a repeated request skips the handler, the database and the compressor. Every successful write
+#   drops them all by moving to a new generation of keys (see invalidate_responses).
+
+BROTLI = find_spec('brotli') is not None
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+GENERATION_KEY = 'response:generation'
+
+def invalidate_responses() -> None:
+    # the entries of the previous generation are never read again, the cache evicts them
+    current_cache().set(GENERATION_KEY, uuid4().hex.encode())
+
+def _generation() -> str:
+    generation = current_cache().peek(GENERATION_KEY)
+    if generation is None:
+        # evicted or expired: a fresh one, an old generation could still have entries around
+        invalidate_responses()
+        generation = current_cache().peek(GENERATION_KEY) or b''
+    return generation.decode()
+
+def parse_cache_control(value: str) -> Dict[str, str]:
+    # "/product/list=public, max-age=30; /client/list=private, max-age=10", keyed by route template
+    policies = {}
+    for item in filter(None, (item.strip() for item in value.split(';'))):
+        route, policy = item.split('=', 1)
+        policies[route.strip()] = policy.strip()
+    return policies
+
+def accepted_encoding(scope: Scope) -> Optional[str]:
+    qualities = {}
+    for item in Headers(scope=scope).get('accept-encoding', '').split(','):
+        name, _, parameter = item.partition(';')
+        try:
+            quality = float(parameter.strip().removeprefix('q=')) if parameter else 1.0
+        except ValueError:
+            quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    for encoding in ('br', 'gzip') if BROTLI else ('gzip',):
+        if qualities.get(encoding, qualities.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(body, quality=settings.BROTLI_QUALITY)
+    return gzip.compress(body, settings.GZIP_LEVEL, mtime=0)
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            import brotli
+            compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+            self.compress, self.finish = compressor.process, compressor.finish
+        else:
+            # wbits 31: a gzip member rather than a bare zlib stream
+            compressor = zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress, self.finish = compressor.compress, compressor.flush
+
+# cached responses carry their headers as a JSON line before the body
+def _response_entry(start: Message, body: bytes) -> bytes:
+    headers = [[name.decode('latin-1'), value.decode('latin-1')] for name, value in start['headers']]
+    return json.dumps(headers).encode() + b'\n' + body
+
+async def _send_response_entry(send: Send, entry: bytes) -> None:
+    headers, body = entry.split(b'\n', 1)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in json.loads(headers)]})
+    await send({'type': 'http.response.body', 'body': body})
+
+class _Responder:
+    def __init__(self, middleware: 'HttpCacheMiddleware', scope: Scope, send: Send, encoding: Optional[str], key: Optional[str]):
+        self.middleware = middleware
+        self.scope = scope
+        self._send = send
+        self.encoding = encoding
+        self.key = key
+        self.status = 500
+        # background writes (202) invalidate once applied, see client/jobs/queue.py
+        self.write = scope['method'] in WRITE_METHODS
+        # held back until the first body chunk tells whether the response is compressed
+        self.start: Optional[Message] = None
+        self.compressor: Optional[StreamCompressor] = None
+
+    async def send(self, message: Message) -> None:
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            self.start = message
+            return
+        if message['type'] != 'http.response.body':
+            await self._send(message)
+            return
+
+        # a write invalidates before its last body chunk goes out: the client, or another worker sharing
+        # the cache, may ask for the list again as soon as it has the response
+        if self.write and not message.get('more_body', False) and self.status < 400 and self.status != 202:
+            invalidate_responses()
+
+        if self.start is not None:
+            start, self.start = self.start, None
+            await self._send_first(start, message)
+        elif self.compressor is not None:
+            more_body = message.get('more_body', False)
+            body = self.compressor.compress(message.get('body', b''))
+            if not more_body:
+                body += self.compressor.finish()
+            await self._send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+        else:
+            await self._send(message)
+
+    async def _send_first(self, start: Message, message: Message) -> None:
+        headers = MutableHeaders(scope=start)
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        route: Optional[BaseRoute] = self.scope.get('route')
+
+        if self.status == 200 and route is not None and 'cache-control' not in headers:
+            policy = self.middleware.cache_control.get(route.path)
+            if policy:
+                headers['Cache-Control'] = policy
+
+        compressible = (settings.COMPRESSION and 'content-encoding' not in headers
+                        and headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES))
+        if compressible:
+            headers.add_vary_header('Accept-Encoding')
+        compressed = compressible and self.encoding is not None
+
+        if more_body:
+            if compressed:
+                self.compressor = StreamCompressor(self.encoding)
+                del headers['Content-Length']
+                headers['Content-Encoding'] = self.encoding
+                body = self.compressor.compress(body)
+            await self._send(start)
+            await self._send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            return
+
+        if compressed and len(body) >= settings.COMPRESSION_MIN_SIZE:
+            body = compress(body, self.encoding)
+            headers['Content-Encoding'] = self.encoding
+            headers['Content-Length'] = str(len(body))
+        # before sending: the outer middlewares add their own headers to the message (e.g. Server-Timing)
+        if self.key is not None and self.status == 200:
+            current_cache().set(self.key, _response_entry(start, body))
+            self.middleware.routes[self.scope['path']] = route
+
+        await self._send(start)
+        await self._send({'type': 'http.response.body', 'body': body})
+
+class HttpCacheMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.cache_control = parse_cache_control(settings.CACHE_CONTROL)
+        self.cached_paths = {path.strip() for path in settings.RESPONSE_CACHE_ROUTES.split(',') if path.strip()}
+        # path -> route of the cached responses, the router doesn't run for a hit
+        self.routes: Dict[str, Optional[BaseRoute]] = {}
+
+    def _cache_key(self, scope: Scope, encoding: Optional[str]) -> Optional[str]:
+        if scope['method'] != 'GET' or scope['path'] not in self.cached_paths:
+            return None
+
+        # only the first pages, a client walking the whole list would just churn the cache
+        params = QueryParams(scope['query_string'])
+        try:
+            page = int(params.get('page', '1'))
+        except ValueError:
+            return None
+        if 'cursor' in params or page > settings.RESPONSE_CACHE_PAGES:
+            return None
+
+        return f"response:{_generation()}:{encoding or 'identity'}:{scope['path']}?{scope['query_string'].decode('latin-1')}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = accepted_encoding(scope) if settings.COMPRESSION else None
+        key = self._cache_key(scope, encoding)
+        if key is not None:
+            entry = current_cache().get(key)
+            if entry is not None:
+                # reported under its route by the request metrics
+                scope['route'] = self.routes.get(scope['path'])
+                await _send_response_entry(send, entry)
+                return
+
+        responder = _Responder(self, scope, send, encoding, key)
+        await self.app(scope, receive, responder.send)
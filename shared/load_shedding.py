@@ -0,0 +1,181 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+from typing import Deque, Dict, List, Optional, Tuple
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+from shared import metrics, settings
+
+# Overload protection, in front of the routers: a token bucket per client (SOLARIS_RATE_LIMIT)
+# answers 429 to the clients going over their rate, and a concurrency cap per route
+# (SOLARIS_ROUTE_CONCURRENCY) lets at most that many requests of the route reach the database at
+# once. The others wait in line and get 503 when no slot frees up within SOLARIS_ROUTE_QUEUE_TIMEOUT,
+# so a burst on an expensive route can't starve the connection pool for the cheap ones.
+# Both are counted per worker process.
+
+class RateLimiter:
+    # 0 when the client may send one more request, otherwise the seconds until it may;
+    # a backend shared by the workers (e.g. redis) implements this one method
+    def acquire(self, key: str) -> float:
+        raise NotImplementedError
+
+class MemoryRateLimiter(RateLimiter):
+    def __init__(self, rate: float, burst: int, max_clients: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # client -> (tokens left, monotonic time they were counted), least recently seen first
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = Lock()
+
+    def acquire(self, key: str) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, counted = self._buckets.pop(key, (self.burst, now))
+            tokens = min(tokens + (now - counted) * self.rate, self.burst)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[key] = (tokens, now)
+            # a forgotten client starts over with a full bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+class ConcurrencyLimit:
+    # slots of one route, handed over in arrival order; only used from the event loop
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if timeout <= 0:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return self._handed_over(waiter)
+        except asyncio.CancelledError:
+            if self._handed_over(waiter):
+                self.release()
+            raise
+        return True
+
+    def _handed_over(self, waiter: asyncio.Future) -> bool:
+        # release() may have given it the slot right as the wait ended
+        if not waiter.cancel() and not waiter.cancelled():
+            return True
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        return False
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # the slot goes to the next in line, active stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+def parse_route_limits(value: str) -> Dict[str, int]:
+    # "/client/list=8,/client/export=2", keyed by route template
+    limits = {}
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        route, limit = item.rsplit('=', 1)
+        limits[route.strip()] = int(limit)
+    return limits
+
+# (reason, route template) -> requests answered 429/503
+_shed: Dict[Tuple[str, str], int] = {}
+_lock = Lock()
+
+def _count_shed(reason: str, route: str) -> None:
+    with _lock:
+        _shed[(reason, route)] = _shed.get((reason, route), 0) + 1
+
+def create_rate_limiter() -> Optional[RateLimiter]:
+    if settings.RATE_LIMIT <= 0:
+        return None
+    return MemoryRateLimiter(settings.RATE_LIMIT, settings.RATE_LIMIT_BURST, settings.RATE_LIMIT_MAX_CLIENTS)
+
+async def _reject(scope: Scope, receive: Receive, send: Send, status_code: int, detail: str, retry_after: float) -> None:
+    response = JSONResponse({'detail': detail}, status_code=status_code, headers={'Retry-After': str(max(math.ceil(retry_after), 1))})
+    await response(scope, receive, send)
+
+class LoadSheddingMiddleware:
+    def __init__(self, app: ASGIApp, routes: List[BaseRoute], rate_limiter: Optional[RateLimiter] = None):
+        self.app = app
+        # the app's routes, to tell which one a request is for before the router runs
+        self.routes = routes
+        self.rate_limiter = rate_limiter if rate_limiter is not None else create_rate_limiter()
+        self.limits = {route: ConcurrencyLimit(limit) for route, limit in parse_route_limits(settings.ROUTE_CONCURRENCY).items()}
+
+    def _client_key(self, scope: Scope) -> str:
+        if settings.RATE_LIMIT_KEY_HEADER:
+            name = settings.RATE_LIMIT_KEY_HEADER.lower().encode('latin-1')
+            for header, value in scope['headers']:
+                if header == name:
+                    # X-Forwarded-For lists the original client first
+                    return value.decode('latin-1').split(',')[0].strip()
+        client = scope.get('client')
+        return client[0] if client else ''
+
+    def _route(self, scope: Scope) -> Optional[BaseRoute]:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.acquire(self._client_key(scope))
+            if wait > 0:
+                _count_shed('rate_limit', 'unmatched')
+                await _reject(scope, receive, send, 429, 'Too many requests.', wait)
+                return
+
+        route = self._route(scope) if self.limits else None
+        limit = self.limits.get(route.path) if route is not None else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limit.acquire(settings.ROUTE_QUEUE_TIMEOUT):
+            _count_shed('concurrency', route.path)
+            # reported under its route by the request metrics
+            scope['route'] = route
+            await _reject(scope, receive, send, 503, 'Server busy, try again later.', settings.ROUTE_QUEUE_TIMEOUT)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+def _shed_lines() -> List[str]:
+    with _lock:
+        return [f'solaris_http_requests_shed_total{{reason="{reason}",route="{route}"}} {count}'
+                for (reason, route), count in sorted(_shed.items())]
+
+metrics.register_collector(_shed_lines)
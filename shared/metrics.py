@@ -0,0 +1,116 @@
+import time
+from threading import Lock
+from typing import Callable, Dict, List
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+router = APIRouter()
+
+class PoolStats:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.lock = Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self.wait_max_seconds = 0.0
+
+    def observe_wait(self, seconds: float) -> None:
+        with self.lock:
+            self.wait_count += 1
+            self.wait_seconds += seconds
+            self.wait_max_seconds = max(self.wait_max_seconds, seconds)
+
+# engine name -> stats of its pool
+_pools: Dict[str, PoolStats] = {}
+# other modules report through functions returning their metric lines
+_collectors: List[Callable[[], List[str]]] = []
+
+def register_collector(collector: Callable[[], List[str]]) -> None:
+    _collectors.append(collector)
+
+class _TimedPoolMixin:
+    # time spent waiting for a free connection (or opening a new one) on checkout;
+    # there is no pool event fired before a checkout starts, so it is measured here
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = getattr(self, '_solaris_stats', None)
+            if stats is not None:
+                stats.observe_wait(time.perf_counter() - start)
+
+    # engine.dispose() swaps in a recreated pool, keep reporting into the same stats
+    def recreate(self):
+        pool = super().recreate()
+        pool._solaris_stats = getattr(self, '_solaris_stats', None)
+        return pool
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+def instrument_pool(engine: Engine, name: str) -> PoolStats:
+    pool = engine.pool
+    stats = PoolStats(engine)
+    pool._solaris_stats = stats
+
+    @event.listens_for(pool, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        with stats.lock:
+            stats.connects += 1
+
+    @event.listens_for(pool, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with stats.lock:
+            stats.checkouts += 1
+
+    @event.listens_for(pool, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with stats.lock:
+            stats.invalidations += 1
+
+    _pools[name] = stats
+    return stats
+
+def _pool_lines(name: str, stats: PoolStats) -> List[str]:
+    label = f'{{engine="{name}"}}'
+    lines = []
+    pool = stats.engine.pool
+    if isinstance(pool, QueuePool):
+        lines += [
+            f'solaris_db_pool_size{label} {pool.size()}',
+            f'solaris_db_pool_checked_out{label} {pool.checkedout()}',
+            f'solaris_db_pool_idle{label} {pool.checkedin()}',
+            f'solaris_db_pool_overflow{label} {max(pool.overflow(), 0)}',
+        ]
+    with stats.lock:
+        lines += [
+            f'solaris_db_pool_connects_total{label} {stats.connects}',
+            f'solaris_db_pool_checkouts_total{label} {stats.checkouts}',
+            f'solaris_db_pool_invalidations_total{label} {stats.invalidations}',
+            f'solaris_db_pool_wait_seconds_sum{label} {stats.wait_seconds:.6f}',
+            f'solaris_db_pool_wait_seconds_count{label} {stats.wait_count}',
+            f'solaris_db_pool_wait_seconds_max{label} {stats.wait_max_seconds:.6f}',
+        ]
+    return lines
+
+def render_metrics() -> str:
+    lines = []
+    for name, stats in _pools.items():
+        lines += _pool_lines(name, stats)
+    for collector in _collectors:
+        lines += collector()
+    return '\n'.join(lines) + '\n'
+
+@router.get("/metrics")
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
@@ -0,0 +1,124 @@
+import time
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from shared import metrics, settings
+
+# upper bounds (seconds) of the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestTrace:
+    # database work of the request being served, filled in by the cursor hooks
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+    def server_timing(self, seconds: float) -> str:
+        return f'db;dur={self.db_seconds * 1000:.3f};desc="statements={self.statements} rows={self.rows}", app;dur={seconds * 1000:.3f}'
+
+class RouteStats:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+# the handlers run in the threadpool (or a greenlet on the async stack), both copy the context of the request
+_trace: ContextVar[Optional[RequestTrace]] = ContextVar('solaris_request_trace', default=None)
+# (method, route template) -> stats
+_routes: Dict[Tuple[str, str], RouteStats] = {}
+_lock = Lock()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context rather than the connection: a statement that raises
+    # never reaches after_cursor_execute and the context goes away with it
+    context._solaris_query_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    start = getattr(context, '_solaris_query_start', None)
+    if trace is None or start is None:
+        return
+
+    trace.statements += 1
+    trace.db_seconds += time.perf_counter() - start
+    # as reported by the driver: psycopg2 knows the rows of a SELECT once it ran, sqlite doesn't (-1)
+    if cursor.description is not None and cursor.rowcount > 0:
+        trace.rows += cursor.rowcount
+
+def instrument_queries(engine: Engine) -> None:
+    # also accepts the Engine class itself, to trace every engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+def observe(method: str, route: str, seconds: float, trace: RequestTrace) -> None:
+    with _lock:
+        stats = _routes.get((method, route))
+        if stats is None:
+            stats = _routes[(method, route)] = RouteStats()
+
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                stats.buckets[index] += 1
+                break
+        stats.count += 1
+        stats.seconds += seconds
+        stats.statements += trace.statements
+        stats.db_seconds += trace.db_seconds
+        stats.rows += trace.rows
+
+class RequestMetricsMiddleware:
+    # plain ASGI rather than BaseHTTPMiddleware, which would run every request in an extra task
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _trace.set(trace)
+        start = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message['type'] == 'http.response.start' and settings.SERVER_TIMING:
+                MutableHeaders(scope=message).append('Server-Timing', trace.server_timing(time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+            # the router stores the matched route in the scope, its path is the template (e.g. /client/{id_client})
+            route = scope.get('route')
+            observe(scope['method'], route.path if route is not None else 'unmatched', time.perf_counter() - start, trace)
+
+def _request_lines() -> List[str]:
+    lines = []
+    with _lock:
+        for (method, route), stats in sorted(_routes.items()):
+            label = f'method="{method}",route="{route}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'solaris_http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines += [
+                f'solaris_http_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats.count}',
+                f'solaris_http_request_duration_seconds_sum{{{label}}} {stats.seconds:.6f}',
+                f'solaris_http_request_duration_seconds_count{{{label}}} {stats.count}',
+                f'solaris_http_request_db_statements_total{{{label}}} {stats.statements}',
+                f'solaris_http_request_db_seconds_total{{{label}}} {stats.db_seconds:.6f}',
+                f'solaris_http_request_db_rows_total{{{label}}} {stats.rows}',
+            ]
+    return lines
+
+metrics.register_collector(_request_lines)
@@ -0,0 +1,49 @@
+import time
+from threading import Lock
+from typing import Dict, Tuple
+from sqlalchemy import Table, func, select, text
+from sqlalchemy.orm import Session
+from shared import settings
+
+# (database url, table name) -> (row count, monotonic time it was computed)
+_row_counts: Dict[Tuple[str, str], Tuple[int, float]] = {}
+_lock = Lock()
+
+def _key(db: Session, table: Table) -> Tuple[str, str]:
+    return str(db.get_bind().url), table.name
+
+def _count_rows(db: Session, table: Table) -> int:
+    if db.get_bind().dialect.name == 'postgresql':
+        # planner estimate kept up to date by autovacuum/analyze, no table scan
+        estimate = db.execute(text('SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)'),
+                              {'name': table.name}).scalar()
+        # -1 means the table was never analyzed
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+
+    return db.execute(select(func.count()).select_from(table)).scalar()
+
+def row_count(db: Session, table: Table) -> int:
+    key = _key(db, table)
+    cached = _row_counts.get(key)
+    if cached is not None and time.monotonic() - cached[1] < settings.ROW_COUNT_MAX_AGE:
+        return cached[0]
+
+    count = _count_rows(db, table)
+    with _lock:
+        _row_counts[key] = (count, time.monotonic())
+
+    return count
+
+def adjust_row_count(db: Session, table: Table, delta: int) -> None:
+    # keeps a cached count in step with writes made by this process,
+    # other processes' writes are picked up once the entry gets stale
+    key = _key(db, table)
+    with _lock:
+        cached = _row_counts.get(key)
+        if cached is not None:
+            _row_counts[key] = (max(cached[0] + delta, 0), cached[1])
+
+def clear_row_counts() -> None:
+    with _lock:
+        _row_counts.clear()
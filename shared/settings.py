@@ -0,0 +1,111 @@
+import os
+from typing import Optional
+
+def _flag(name: str, default: bool = False) -> bool:
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+def _default_database_url() -> str:
+    username = os.getenv('SOLARIS_DB_USERNAME')
+    password = os.getenv('SOLARIS_DB_PASSWORD')
+    if username is None:
+        # credentials used to live in an untracked local_settings.py, keep reading it when present
+        try:
+            from local_settings import DB_USERNAME as username, DB_PASSWORD as password
+        except ImportError:
+            pass
+
+    host = os.getenv('SOLARIS_DB_HOST', 'localhost')
+    name = os.getenv('SOLARIS_DB_NAME', 'db_solaris')
+    return f"postgresql://{username}:{password}@{host}/{name}"
+
+DATABASE_URL: Optional[str] = os.getenv('SOLARIS_DATABASE_URL')
+
+def database_url() -> str:
+    # resolved when the engine is created, so importing the app never needs the credentials
+    return DATABASE_URL or _default_database_url()
+
+# derived from DATABASE_URL when not set (asyncpg for postgres, aiosqlite for sqlite)
+ASYNC_DATABASE_URL: Optional[str] = os.getenv('SOLARIS_ASYNC_DATABASE_URL')
+
+# serve the api with async handlers over an async engine instead of the threadpool
+DB_ASYNC = _flag('SOLARIS_DB_ASYNC')
+# open the first connection while the app starts instead of on the first request
+DB_WARMUP = _flag('SOLARIS_DB_WARMUP')
+
+# production server (python main.py), each CLI flag overrides its variable
+SERVER_HOST = os.getenv('SOLARIS_SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SOLARIS_SERVER_PORT', '3030'))
+# one process per core by default, every worker has its own connection pool (see DB_POOL_SIZE)
+SERVER_WORKERS = int(os.getenv('SOLARIS_SERVER_WORKERS', str(os.cpu_count() or 1)))
+SERVER_KEEP_ALIVE = int(os.getenv('SOLARIS_SERVER_KEEP_ALIVE', '5'))
+SERVER_BACKLOG = int(os.getenv('SOLARIS_SERVER_BACKLOG', '2048'))
+# seconds given to in-flight requests on shutdown before the workers are stopped
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SOLARIS_SERVER_GRACEFUL_TIMEOUT', '30'))
+SERVER_ACCESS_LOG = _flag('SOLARIS_SERVER_ACCESS_LOG', True)
+
+# response compression (shared/http_cache.py): brotli when the package is installed and the client
+# accepts it, gzip otherwise, for bodies of at least COMPRESSION_MIN_SIZE bytes
+COMPRESSION = _flag('SOLARIS_COMPRESSION', True)
+COMPRESSION_MIN_SIZE = int(os.getenv('SOLARIS_COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('SOLARIS_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('SOLARIS_BROTLI_QUALITY', '4'))
+# Cache-Control of each route, "<route template>=<policy>" separated by semicolons
+CACHE_CONTROL = os.getenv('SOLARIS_CACHE_CONTROL', '/product/list=public, max-age=30; /product/top=public, max-age=30; '
+                                                   '/client/list=private, max-age=10')
+# list routes whose first RESPONSE_CACHE_PAGES pages are cached compressed (in the CACHE_BACKEND), per query
+RESPONSE_CACHE_ROUTES = os.getenv('SOLARIS_RESPONSE_CACHE_ROUTES', '/product/list,/client/list')
+RESPONSE_CACHE_PAGES = int(os.getenv('SOLARIS_RESPONSE_CACHE_PAGES', '1'))
+
+# load shedding (shared/load_shedding.py), per worker process: requests per second allowed to each
+# client after a burst of RATE_LIMIT_BURST (0 turns it off), clients told apart by their address or
+# by RATE_LIMIT_KEY_HEADER (e.g. X-Forwarded-For behind a proxy, an API key header)
+RATE_LIMIT = float(os.getenv('SOLARIS_RATE_LIMIT', '0'))
+RATE_LIMIT_BURST = int(os.getenv('SOLARIS_RATE_LIMIT_BURST', '20'))
+RATE_LIMIT_KEY_HEADER: Optional[str] = os.getenv('SOLARIS_RATE_LIMIT_KEY_HEADER')
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv('SOLARIS_RATE_LIMIT_MAX_CLIENTS', '10000'))
+# requests of a route served at once, e.g. "/client/list=8,/client/export=2", and the seconds
+# the others wait for a slot before getting a 503
+ROUTE_CONCURRENCY = os.getenv('SOLARIS_ROUTE_CONCURRENCY', '')
+ROUTE_QUEUE_TIMEOUT = float(os.getenv('SOLARIS_ROUTE_QUEUE_TIMEOUT', '0.5'))
+
+# connection pool, see https://docs.sqlalchemy.org/en/20/core/pooling.html
+DB_POOL_SIZE = int(os.getenv('SOLARIS_DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('SOLARIS_DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('SOLARIS_DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('SOLARIS_DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = _flag('SOLARIS_DB_POOL_PRE_PING', True)
+# milliseconds, 0 disables it (postgres only)
+DB_STATEMENT_TIMEOUT = int(os.getenv('SOLARIS_DB_STATEMENT_TIMEOUT', '0'))
+
+# serve the list endpoints from Core rows dumped by orjson instead of ORM objects validated by pydantic
+FAST_READS = _flag('SOLARIS_FAST_READS', True)
+
+# add a Server-Timing header with the database time and statement count of each request
+SERVER_TIMING = _flag('SOLARIS_SERVER_TIMING')
+
+# read-through cache of product/client payloads: memory (per process LRU), redis or none
+CACHE_BACKEND = os.getenv('SOLARIS_CACHE_BACKEND', 'memory').lower()
+CACHE_TTL = float(os.getenv('SOLARIS_CACHE_TTL', '300'))
+CACHE_MAX_ENTRIES = int(os.getenv('SOLARIS_CACHE_MAX_ENTRIES', '10000'))
+CACHE_REDIS_URL = os.getenv('SOLARIS_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+# rows validated and inserted per transaction by /product/bulk
+BULK_CHUNK_SIZE = int(os.getenv('SOLARIS_BULK_CHUNK_SIZE', '1000'))
+# errors listed in a bulk import report, the rest are only counted
+BULK_MAX_REPORTED_ERRORS = int(os.getenv('SOLARIS_BULK_MAX_REPORTED_ERRORS', '1000'))
+
+# clients fetched (and favorites loaded) per round trip by /client/export
+EXPORT_BATCH_SIZE = int(os.getenv('SOLARIS_EXPORT_BATCH_SIZE', '1000'))
+
+# answer the heavy writes (client update, product delete) with 202 and a job, applied in the background
+BACKGROUND_WRITES = _flag('SOLARIS_BACKGROUND_WRITES')
+# queued jobs applied per transaction
+JOB_BATCH_SIZE = int(os.getenv('SOLARIS_JOB_BATCH_SIZE', '100'))
+# seconds after which a running job is taken to belong to a stopped process and claimed again
+JOB_CLAIM_TIMEOUT = float(os.getenv('SOLARIS_JOB_CLAIM_TIMEOUT', '300'))
+
+# clients accepted by one call of the /client/batch endpoints
+BATCH_MAX_SIZE = int(os.getenv('SOLARIS_BATCH_MAX_SIZE', '1000'))
+
+# how long (in seconds) a cached table row count may be served before it is recomputed
+ROW_COUNT_MAX_AGE = float(os.getenv('SOLARIS_ROW_COUNT_MAX_AGE', '60'))
@@ -0,0 +1,120 @@
+import json
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from main import create_app
+from shared.cache import cache
+from shared.database import Base
+from shared.dependencies import get_async_db, get_db
+
+app = create_app(async_db=True)
+client = TestClient(app)
+
+SQLALCHEMY_DATABASE_URL = 'sqlite:///.test.db'
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread':False})
+TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# every TestClient request runs on its own event loop, so connections can't be pooled across them
+async_engine = create_async_engine('sqlite+aiosqlite:///.test.db', poolclass=NullPool)
+TestAsyncSessionLocal = async_sessionmaker(autoflush=False, bind=async_engine)
+
+async def override_get_async_db():
+    db = TestAsyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+# async handlers (bulk import) keep using the sync session
+def override_get_db():
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_db] = override_get_db
+
+@pytest.fixture(autouse=True)
+def setup_database():
+    # new database for each test
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    cache.clear()
+
+product = { "price": 5000,
+            "image": "img001.jpg",
+            "brand": "Brand 1",
+            "title": "Title 1",
+            "review_score": 4.75
+          }
+
+def test_async_product_endpoints():
+    response = client.post('/product/register', json=product)
+    assert response.status_code == 201
+    assert response.json() == {'id': 1, **product}
+
+    response = client.get('/product/1')
+    assert response.status_code == 200
+    assert response.json() == {'id': 1, **product}
+
+    response = client.get('/product/list', params={'page_size': 1})
+    assert response.status_code == 200
+    assert response.json() == [{'id': 1, **product}]
+    assert 'X-Next-Cursor' in response.headers
+
+    response = client.delete('/product/delete/1')
+    assert response.status_code == 204
+
+    response = client.get('/product/1')
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'Product not found.'}
+
+def test_async_client_endpoints():
+    for _ in range(2):
+        assert client.post('/product/register', json=product).status_code == 201
+
+    response = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    assert response.status_code == 201
+    client_id = response.json()['id']
+
+    response = client.put(f'/client/update/{client_id}', json={'name': 'Magalu', 'email': 'magalu@mail.com', 'favorite_products': [1]})
+    assert response.status_code == 200
+    assert [p['id'] for p in response.json()['favorite_products']] == [1]
+
+    response = client.post(f'/client/{client_id}/favorites', json={'product_ids': [2]})
+    assert response.status_code == 204
+
+    response = client.get('/client/list')
+    assert response.status_code == 200
+    assert [p['id'] for p in response.json()[0]['favorite_products']] == [1, 2]
+
+    response = client.delete(f'/client/delete/{client_id}')
+    assert response.status_code == 204
+
+    response = client.get(f'/client/{client_id}')
+    assert response.status_code == 404
+
+def test_async_bulk_product_import():
+    response = client.post('/product/bulk', content=json.dumps(product), headers={'Content-Type': 'application/x-ndjson'})
+    assert response.status_code == 200
+    assert response.json() == {'inserted': 1, 'failed': 0, 'errors': []}
+
+def test_async_export_clients():
+    response = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    assert response.status_code == 201
+
+    response = client.get('/client/export')
+    assert response.status_code == 200
+    assert [json.loads(line)['name'] for line in response.text.splitlines()] == ['Magalu']
+
+def test_async_request_tracing(max_queries):
+    client.post('/product/register', json=product)
+
+    # the statements run in a greenlet on the async engine are traced as well
+    response = client.get('/product/list')
+    assert 'statements=1 ' in response.headers['Server-Timing']
+    max_queries(response, 1)
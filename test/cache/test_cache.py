@@ -0,0 +1,158 @@
+import time
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from main import app
+from shared import cache as cache_module
+from shared.cache import MemoryCache, RedisCache
+from shared.database import Base
+from shared.dependencies import get_db
+
+client = TestClient(app)
+
+SQLALCHEMY_DATABASE_URL = 'sqlite:///.test.db'
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread':False})
+TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def set(self, name, value, ex=None):
+        self.values[name] = value
+
+    def delete(self, *names):
+        for name in names:
+            self.values.pop(name, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def scan_iter(self, match='*'):
+        return [name for name in self.values if name.startswith(match.rstrip('*'))]
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, name, value, ex=None):
+        self.commands.append((name, value))
+
+    def execute(self):
+        for name, value in self.commands:
+            self.redis.set(name, value)
+
+@pytest.fixture(autouse=True)
+def setup_database(monkeypatch):
+    # new database and cache for each test
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    test_cache = RedisCache(FakeRedis(), ttl=60)
+    app.dependency_overrides[get_db] = override_get_db
+    # the routes, the response cache and the job worker all use it
+    monkeypatch.setattr(cache_module, 'cache', test_cache)
+    return test_cache
+
+product = { "price": 5000,
+            "image": "img001.jpg",
+            "brand": "Brand 1",
+            "title": "Title 1",
+            "review_score": 4.75
+          }
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2, ttl=60)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    assert cache.get('a') == b'1'
+
+    cache.set('c', b'3')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    assert cache.get('c') == b'3'
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_memory_cache_expires_entries():
+    cache = MemoryCache(max_entries=2, ttl=0.01)
+    cache.set('a', b'1')
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+@pytest.mark.parametrize('cache', [MemoryCache(max_entries=10, ttl=60), RedisCache(FakeRedis(), ttl=60)])
+def test_fill_after_a_write_is_dropped(cache):
+    # a reader misses and loads the row, a write commits and invalidates, then the reader stores its copy
+    assert cache.get('a') is None
+    lease = cache.lease('a')
+    cache.delete('a')
+    cache.fill('a', b'stale', lease)
+    assert cache.get('a') is None
+
+    # nothing written meanwhile
+    lease = cache.lease('a')
+    cache.fill('a', b'fresh', lease)
+    assert cache.get('a') == b'fresh'
+
+def test_response_cache_uses_the_same_cache(setup_database):
+    assert client.get('/product/list').status_code == 200
+    assert any(key.startswith('solaris:response:') for key in setup_database.client.values)
+
+def test_product_by_id_is_cached(setup_database):
+    assert client.post('/product/register', json=product).status_code == 201
+
+    response = client.get('/product/1')
+    assert response.status_code == 200
+    assert (setup_database.hits, setup_database.misses) == (0, 1)
+
+    cached_response = client.get('/product/1')
+    assert cached_response.status_code == 200
+    assert cached_response.json() == response.json() == {'id': 1, **product}
+    assert (setup_database.hits, setup_database.misses) == (1, 1)
+
+    assert client.delete('/product/delete/1').status_code == 204
+    assert client.get('/product/1').status_code == 404
+
+def test_deleted_product_invalidates_clients(setup_database):
+    assert client.post('/product/register', json=product).status_code == 201
+    id_client = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).json()['id']
+    assert client.post(f'/client/{id_client}/favorites', json={'product_ids': [1]}).status_code == 204
+
+    assert len(client.get(f'/client/{id_client}').json()['favorite_products']) == 1
+    assert len(client.get(f'/client/{id_client}').json()['favorite_products']) == 1
+    assert setup_database.hits == 1
+
+    assert client.delete('/product/delete/1').status_code == 204
+    assert client.get(f'/client/{id_client}').json()['favorite_products'] == []
+
+def test_client_writes_invalidate_client(setup_database):
+    assert client.post('/product/register', json=product).status_code == 201
+    id_client = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).json()['id']
+    assert client.get(f'/client/{id_client}').json()['favorite_products'] == []
+
+    client.put(f'/client/update/{id_client}', json={'name': 'Luizalabs', 'email': 'magalu@mail.com', 'favorite_products': [1]})
+    response = client.get(f'/client/{id_client}')
+    assert response.json()['name'] == 'Luizalabs'
+    assert len(response.json()['favorite_products']) == 1
+
+    client.request('DELETE', f'/client/{id_client}/favorites', json={'product_ids': [1]})
+    assert client.get(f'/client/{id_client}').json()['favorite_products'] == []
+
+    assert client.delete(f'/client/delete/{id_client}').status_code == 204
+    assert client.get(f'/client/{id_client}').status_code == 404
+
+def test_metrics_report_cache_counters():
+    lines = client.get('/metrics').text.splitlines()
+    assert any(line.startswith('solaris_cache_hits_total ') for line in lines)
+    assert any(line.startswith('solaris_cache_misses_total ') for line in lines)
@@ -1,9 +1,14 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from fastapi.testclient import TestClient
 import pytest
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert
 from main import app
+from shared import settings
+from client.models.product_model import Product
+from shared.cache import cache
 from shared.database import Base
 from shared.dependencies import get_db
 from shared.exceptions import NotFound
@@ -28,6 +33,13 @@ def setup_database():
     # new database for each test
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    cache.clear()
+
+def seed_products(count: int) -> None:
+    with TestSessionLocal() as db:
+        db.execute(insert(Product), [{'price': 10, 'image': f'img{i}.jpg', 'brand': 'Brand', 'title': f'Title {i}', 'review_score': 4}
+                                     for i in range(count)])
+        db.commit()
 
 def test_successful_client_registration():
     new_client = {
@@ -57,6 +69,32 @@ def test_duplicate_email_client_registration():
         assert e.status_code == 409
         assert e.detail == {'detail': 'Email already registered.'}
 
+def test_concurrent_client_registration_with_same_email():
+    new_client = {
+        'name': 'Magalu',
+        'email': 'magalu@mail.com'
+    }
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: client.post('/client/register', json=new_client), range(8)))
+
+    assert sorted(response.status_code for response in responses) == [201] + [409] * 7
+    assert {response.json()['detail'] for response in responses if response.status_code == 409} == {'Email already registered.'}
+    assert len(client.get('/client/list').json()) == 1
+
+def test_client_update_to_email_in_use():
+    first = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).json()
+    client.post('/client/register', json={'name': 'Luizalabs', 'email': 'luizalabs@mail.com'})
+
+    response = client.put(f"/client/update/{first['id']}", json={'name': 'Magalu', 'email': 'luizalabs@mail.com', 'favorite_products': []})
+    assert response.status_code == 409
+    assert response.json() == {'detail': 'Email already in use.'}
+    assert client.get(f"/client/{first['id']}").json()['email'] == 'magalu@mail.com'
+
+    # keeping its own email is not a conflict
+    response = client.put(f"/client/update/{first['id']}", json={'name': 'Magazine', 'email': 'magalu@mail.com', 'favorite_products': []})
+    assert response.status_code == 200
+
 def test_successful_client_by_id():
     new_client = {
         'name': 'Magalu',
@@ -227,4 +265,246 @@ def test_empty_list_clients():
     response = client.get('/client/list')
 
     assert response.status_code == 200
-    assert response.json() == []
\ No newline at end of file
+    assert response.json() == []
+
+def test_list_clients_with_cursor():
+    for i in range(25):
+        response = client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'})
+        assert response.status_code == 201
+
+    first_page = client.get('/client/list')
+    assert first_page.status_code == 200
+    assert [c['id'] for c in first_page.json()] == list(range(1, 21))
+
+    cursor = first_page.headers['X-Next-Cursor']
+    second_page = client.get('/client/list', params={'cursor': cursor})
+    assert second_page.status_code == 200
+    assert [c['id'] for c in second_page.json()] == list(range(21, 26))
+    assert 'X-Next-Cursor' not in second_page.headers
+
+    # offset pagination keeps working for old clients
+    assert client.get('/client/list', params={'page': 2}).json() == second_page.json()
+
+def test_list_clients_with_invalid_cursor():
+    response = client.get('/client/list', params={'cursor': 'not-a-cursor'})
+
+    assert response.status_code == 400
+    assert response.json() == {'detail': 'Invalid cursor.'}
+
+def test_client_update_replaces_favorite_products():
+    seed_products(4)
+    response = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    client_id = response.json()['id']
+
+    response = client.put(f'/client/update/{client_id}', json={'name': 'Magalu', 'email': 'magalu@mail.com', 'favorite_products': [1, 2, 3]})
+    assert response.status_code == 200
+    assert sorted(p['id'] for p in response.json()['favorite_products']) == [1, 2, 3]
+
+    # duplicates and unknown products are ignored
+    response = client.put(f'/client/update/{client_id}', json={'name': 'Magalu', 'email': 'magalu@mail.com', 'favorite_products': [3, 4, 4, 99]})
+    assert response.status_code == 200
+    assert sorted(p['id'] for p in response.json()['favorite_products']) == [3, 4]
+
+def test_client_update_favorite_products_query_count(max_queries):
+    seed_products(500)
+    response = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    client_id = response.json()['id']
+
+    response = client.put(f'/client/update/{client_id}', json={'name': 'Magalu', 'email': 'magalu@mail.com', 'favorite_products': list(range(1, 501))})
+    assert response.status_code == 200
+    assert len(response.json()['favorite_products']) == 500
+
+    response = client.put(f'/client/update/{client_id}', json={'name': 'Magalu', 'email': 'magalu@mail.com', 'favorite_products': list(range(251, 751))})
+    assert response.status_code == 200
+    assert len(response.json()['favorite_products']) == 250
+    # the number of statements does not depend on how many favorites change
+    max_queries(response, 10)
+
+def test_add_and_remove_favorite_products():
+    seed_products(5)
+    response = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    client_id = response.json()['id']
+
+    response = client.post(f'/client/{client_id}/favorites', json={'product_ids': [1, 2]})
+    assert response.status_code == 204
+
+    # already favorited and unknown products are skipped
+    response = client.post(f'/client/{client_id}/favorites', json={'product_ids': [2, 3, 99]})
+    assert response.status_code == 204
+
+    response = client.get(f'/client/{client_id}')
+    assert sorted(p['id'] for p in response.json()['favorite_products']) == [1, 2, 3]
+
+    response = client.request('DELETE', f'/client/{client_id}/favorites', json={'product_ids': [1, 3, 5]})
+    assert response.status_code == 204
+
+    response = client.get(f'/client/{client_id}')
+    assert [p['id'] for p in response.json()['favorite_products']] == [2]
+
+def test_notfound_client_favorite_products():
+    response = client.post('/client/1/favorites', json={'product_ids': [1]})
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'Client not found.'}
+
+    response = client.request('DELETE', '/client/1/favorites', json={'product_ids': [1]})
+    assert response.status_code == 404
+
+def test_client_by_id_conditional_get():
+    seed_products(1)
+    response = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    client_id = response.json()['id']
+
+    response = client.get(f'/client/{client_id}')
+    etag = response.headers['ETag']
+
+    response = client.get(f'/client/{client_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # changing only the favorites gives the client a new version
+    response = client.post(f'/client/{client_id}/favorites', json={'product_ids': [1]})
+    assert response.status_code == 204
+
+    response = client.get(f'/client/{client_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.json()['favorite_products']) == 1
+    etag = response.headers['ETag']
+
+    response = client.put(f'/client/update/{client_id}', json={'name': 'Magalu', 'email': 'magalu@mail.com', 'favorite_products': []})
+    assert response.status_code == 200
+
+    response = client.get(f'/client/{client_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json()['favorite_products'] == []
+
+    response = client.get('/client/list')
+    assert response.headers['Last-Modified'].endswith(' GMT')
+
+def test_export_clients(monkeypatch):
+    monkeypatch.setattr(settings, 'EXPORT_BATCH_SIZE', 2)
+    seed_products(3)
+    for i in range(5):
+        response = client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'})
+        client.post(f"/client/{response.json()['id']}/favorites", json={'product_ids': list(range(1, i + 1))})
+
+    response = client.get('/client/export')
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [c['id'] for c in exported] == [1, 2, 3, 4, 5]
+    assert [len(c['favorite_products']) for c in exported] == [0, 1, 2, 3, 3]
+    assert exported[1] == client.get('/client/2').json()
+
+def test_list_clients_loads_favorites_in_one_query(max_queries):
+    seed_products(30)
+    for i in range(3):
+        response = client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'})
+        client.post(f"/client/{response.json()['id']}/favorites", json={'product_ids': list(range(1, 10 * (i + 1) + 1))})
+
+    response = client.get('/client/list')
+    assert [len(c['favorite_products']) for c in response.json()] == [10, 20, 30]
+    # one query for the page, one for the favorites of every client in it
+    max_queries(response, 2)
+
+def test_list_and_get_clients_summary(max_queries):
+    seed_products(1)
+    response = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    client.post(f"/client/{response.json()['id']}/favorites", json={'product_ids': [1]})
+
+    response = client.get('/client/list', params={'fields': 'summary'})
+    assert response.status_code == 200
+    assert response.json() == [{'id': 1, 'name': 'Magalu', 'email': 'magalu@mail.com'}]
+    max_queries(response, 1)
+
+    response = client.get('/client/1', params={'fields': 'summary'})
+    assert response.status_code == 200
+    assert response.json() == {'id': 1, 'name': 'Magalu', 'email': 'magalu@mail.com'}
+    max_queries(response, 1)
+
+    # the summary doesn't replace the cached full payload
+    assert len(client.get('/client/1').json()['favorite_products']) == 1
+
+    response = client.get('/client/list', params={'fields': 'everything'})
+    assert response.status_code == 422
+
+def test_list_clients_fast_path_matches_orm_path(monkeypatch):
+    seed_products(3)
+    for i in range(3):
+        response = client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'})
+        client.post(f"/client/{response.json()['id']}/favorites", json={'product_ids': list(range(1, i + 2))})
+
+    for fields in ('full', 'summary'):
+        monkeypatch.setattr(settings, 'FAST_READS', True)
+        fast = client.get('/client/list', params={'fields': fields})
+        monkeypatch.setattr(settings, 'FAST_READS', False)
+        orm = client.get('/client/list', params={'fields': fields})
+
+        assert fast.status_code == orm.status_code == 200
+        assert fast.json() == orm.json()
+        assert fast.headers['Last-Modified'] == orm.headers['Last-Modified']
+
+@pytest.mark.parametrize('fast_reads', [True, False])
+def test_client_batch_endpoints(monkeypatch, max_queries, fast_reads):
+    monkeypatch.setattr(settings, 'FAST_READS', fast_reads)
+    seed_products(3)
+    batch = [{'name': f'Client {i}', 'email': f'client{i}@mail.com'} for i in range(50)]
+
+    response = client.post('/client/batch', json=batch)
+    assert response.status_code == 201
+    assert [c['email'] for c in response.json()] == [c['email'] for c in batch]
+    max_queries(response, 3)
+    ids = [c['id'] for c in response.json()]
+
+    client.post(f'/client/{ids[0]}/favorites', json={'product_ids': [1, 2]})
+    client.post(f'/client/{ids[1]}/favorites', json={'product_ids': [2, 3]})
+
+    response = client.get('/client/batch', params={'ids': ids[:3] + [999]})
+    assert response.status_code == 200
+    assert [c['id'] for c in response.json()] == ids[:3]
+    assert sorted(p['id'] for p in response.json()[0]['favorite_products']) == [1, 2]
+    assert response.json()[2]['favorite_products'] == []
+    # the clients and then the favorites of all of them
+    max_queries(response, 2)
+
+    response = client.request('DELETE', '/client/batch', params={'ids': ids[:40]})
+    assert response.status_code == 204
+    max_queries(response, 6)
+    assert [c['id'] for c in client.get('/client/batch', params={'ids': ids}).json()] == ids[40:]
+    assert [p['favorite_count'] for p in client.get('/product/top').json()] == [0, 0, 0]
+
+def test_client_batch_registration_is_all_or_nothing():
+    client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+
+    batch = [{'name': 'Luizalabs', 'email': 'luizalabs@mail.com'}, {'name': 'Magalu', 'email': 'magalu@mail.com'}]
+    response = client.post('/client/batch', json=batch)
+    assert response.status_code == 409
+    assert response.json() == {'detail': 'Email already registered.'}
+    assert [c['email'] for c in client.get('/client/list').json()] == ['magalu@mail.com']
+
+def test_client_batch_size_limit(monkeypatch):
+    monkeypatch.setattr(settings, 'BATCH_MAX_SIZE', 2)
+    response = client.get('/client/batch', params={'ids': [1, 2, 3]})
+    assert response.status_code == 422
+
+def test_notfound_client_delete_after_batch_delete():
+    response = client.post('/client/batch', json=[{'name': 'Magalu', 'email': 'magalu@mail.com'}])
+    client_id = response.json()[0]['id']
+
+    assert client.request('DELETE', '/client/batch', params={'ids': [client_id]}).status_code == 204
+    assert client.delete(f'/client/delete/{client_id}').status_code == 404
+
+def test_client_recommendations(max_queries):
+    seed_products(5)
+    ids = [client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'}).json()['id'] for i in range(4)]
+    for id_client, favorites in zip(ids, [[1, 2], [1, 2, 3], [2, 4], [5]]):
+        client.post(f'/client/{id_client}/favorites', json={'product_ids': favorites})
+
+    response = client.get(f'/client/{ids[0]}/recommendations')
+    assert response.status_code == 200
+    # 3 comes with 1 and 2 in one client, 4 only with 2, 5 with neither and the client's own favorites are left out
+    assert [(product['id'], product['score']) for product in response.json()] == [(3, 2), (4, 1)]
+    max_queries(response, 1)
+
+    assert client.get(f'/client/{ids[3]}/recommendations').json() == []
+    assert client.get('/client/99/recommendations').status_code == 404
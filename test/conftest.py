@@ -0,0 +1,19 @@
+import re
+import pytest
+from sqlalchemy.engine import Engine
+from shared import settings
+from shared.request_metrics import instrument_queries
+
+# the test modules build their own engines, trace them all
+instrument_queries(Engine)
+
+@pytest.fixture
+def max_queries(monkeypatch):
+    # max_queries(response, n) fails when the request behind response ran more than n SQL statements
+    monkeypatch.setattr(settings, 'SERVER_TIMING', True)
+
+    def check(response, limit: int) -> None:
+        statements = int(re.search(r'statements=(\d+)', response.headers['Server-Timing']).group(1))
+        assert statements <= limit, f'{response.request.method} {response.request.url.path} ran {statements} statements, expected at most {limit}'
+
+    return check
@@ -0,0 +1,134 @@
+import asyncio
+import gzip
+import json
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, insert
+from main import app
+from client.models.product_model import Product
+from shared.cache import cache
+from shared.database import Base
+from shared.dependencies import get_db
+from shared.http_cache import GENERATION_KEY, HttpCacheMiddleware, accepted_encoding, invalidate_responses, parse_cache_control
+
+client = TestClient(app)
+
+SQLALCHEMY_DATABASE_URL = 'sqlite:///.test.db'
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread':False})
+TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+app.dependency_overrides[get_db] = override_get_db
+
+@pytest.fixture(autouse=True)
+def setup_database():
+    # new database for each test
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    cache.clear()
+
+def insert_products(count: int) -> None:
+    with TestSessionLocal() as db:
+        db.execute(insert(Product), [{'price': 100 + number, 'image': f'img{number}.jpg', 'brand': 'Brand', 'title': f'Title {number}',
+                                      'review_score': 4.5} for number in range(count)])
+        db.commit()
+
+def test_list_compressed_with_cache_control():
+    insert_products(50)
+
+    response = client.get('/product/list', params={'page_size': 50}, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['Cache-Control'] == 'public, max-age=30'
+    assert int(response.headers['Content-Length']) < len(response.content)
+    assert len(response.json()) == 50
+
+    response = client.get('/product/list', params={'page_size': 50}, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.json()) == 50
+
+    # under the size threshold
+    response = client.get('/product/list', params={'page_size': 1}, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+def test_brotli_preferred_when_installed():
+    pytest.importorskip('brotli')
+    insert_products(50)
+
+    response = client.get('/product/list', params={'page_size': 50}, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert len(response.json()) == 50
+
+def test_first_page_served_from_cache_until_a_write(max_queries):
+    insert_products(30)
+
+    first = client.get('/product/list')
+    max_queries(first, 1)
+    cached = client.get('/product/list')
+    max_queries(cached, 0)
+    assert cached.json() == first.json()
+    assert cached.headers['X-Next-Cursor'] == first.headers['X-Next-Cursor']
+    # cursors and later pages always reach the database
+    max_queries(client.get('/product/list', params={'page': 2}), 1)
+    max_queries(client.get('/product/list', params={'page': 2}), 1)
+
+    assert client.delete('/product/delete/1').status_code == 204
+    response = client.get('/product/list')
+    max_queries(response, 1)
+    assert response.json()[0]['id'] == 2
+
+def test_write_invalidates_before_its_body_is_sent():
+    # the generation the client could see when the last chunk of the write reaches it
+    seen = []
+
+    async def write(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 201, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': b'{}'})
+
+    async def client_send(message):
+        if message['type'] == 'http.response.body':
+            seen.append(cache.peek(GENERATION_KEY))
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    invalidate_responses()
+    before = cache.peek(GENERATION_KEY)
+    scope = {'type': 'http', 'method': 'POST', 'path': '/product/register', 'query_string': b'', 'headers': []}
+    asyncio.run(HttpCacheMiddleware(write)(scope, receive, client_send))
+    assert seen and seen[0] != before
+
+def test_generation_reads_are_not_counted():
+    insert_products(3)
+    hits, misses = cache.hits, cache.misses
+
+    client.get('/product/list')
+    client.get('/product/list')
+    # the cached page itself: a miss, then a hit
+    assert (cache.hits - hits, cache.misses - misses) == (1, 1)
+
+def test_streamed_export_compressed():
+    client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+
+    with client.stream('GET', '/client/export', headers={'Accept-Encoding': 'gzip'}) as response:
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in response.headers
+        body = gzip.decompress(b''.join(response.iter_raw()))
+    assert [json.loads(line)['email'] for line in body.splitlines()] == ['magalu@mail.com']
+
+def test_accepted_encoding():
+    assert accepted_encoding({'type': 'http', 'headers': [(b'accept-encoding', b'gzip;q=0.5, deflate')]}) == 'gzip'
+    assert accepted_encoding({'type': 'http', 'headers': [(b'accept-encoding', b'gzip;q=0')]}) is None
+    assert accepted_encoding({'type': 'http', 'headers': []}) is None
+
+def test_parse_cache_control():
+    assert parse_cache_control('/product/list=public, max-age=30; /client/{id_client}=no-cache') == \
+        {'/product/list': 'public, max-age=30', '/client/{id_client}': 'no-cache'}
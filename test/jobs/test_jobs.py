@@ -0,0 +1,178 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from main import app, create_app
+from shared import database, settings
+from client.jobs.queue import JobQueue, job_queue
+from client.models.job_model import Job
+from shared.cache import cache
+from shared.database import Base
+from shared.dependencies import get_db
+
+client = TestClient(app)
+
+SQLALCHEMY_DATABASE_URL = 'sqlite:///.test.db'
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread':False})
+TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+app.dependency_overrides[get_db] = override_get_db
+
+@pytest.fixture(autouse=True)
+def setup_database(monkeypatch):
+    # new database for each test
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    cache.clear()
+    # the worker opens its own sessions, on the same database
+    monkeypatch.setattr(settings, 'DATABASE_URL', SQLALCHEMY_DATABASE_URL)
+    monkeypatch.setattr(database, '_engine', None)
+    monkeypatch.setattr(settings, 'BACKGROUND_WRITES', True)
+
+def register_product(number: int) -> int:
+    response = client.post('/product/register', json={'price': 5000, 'image': f'img{number}.jpg', 'brand': 'Brand',
+                                                      'title': f'Title {number}', 'review_score': 4.75})
+    return response.json()['id']
+
+def test_update_client_in_background():
+    product_ids = [register_product(number) for number in range(3)]
+    id_client = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).json()['id']
+
+    response = client.put(f'/client/update/{id_client}', json={'name': 'Magazine', 'email': 'magalu@mail.com', 'favorite_products': product_ids})
+    assert response.status_code == 202
+    job = response.json()
+    assert job['status'] == 'pending'
+    assert response.headers['Location'] == f"/jobs/{job['id']}"
+
+    assert job_queue.wait(5)
+    assert client.get(f"/jobs/{job['id']}").json() == {'id': job['id'], 'kind': 'client_update', 'target_id': id_client,
+                                                       'status': 'done', 'error': None}
+
+    updated = client.get(f'/client/{id_client}').json()
+    assert updated['name'] == 'Magazine'
+    assert [product['id'] for product in updated['favorite_products']] == product_ids
+    assert [product['favorite_count'] for product in client.get('/product/top').json()] == [1, 1, 1]
+
+def test_failed_job_keeps_its_error():
+    client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    id_client = client.post('/client/register', json={'name': 'Luizalabs', 'email': 'luizalabs@mail.com'}).json()['id']
+
+    id_job = client.put(f'/client/update/{id_client}', json={'name': 'Luizalabs', 'email': 'magalu@mail.com', 'favorite_products': []}).json()['id']
+    assert job_queue.wait(5)
+
+    job = client.get(f'/jobs/{id_job}').json()
+    assert job['status'] == 'failed'
+    assert job['error'] == 'Email already in use.'
+    assert client.get(f'/client/{id_client}').json()['email'] == 'luizalabs@mail.com'
+
+def test_delete_product_in_background():
+    id_product = register_product(1)
+    id_client = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).json()['id']
+    client.post(f'/client/{id_client}/favorites', json={'product_ids': [id_product]})
+    # cached with the product as a favorite
+    assert len(client.get(f'/client/{id_client}').json()['favorite_products']) == 1
+
+    response = client.delete(f'/product/delete/{id_product}')
+    assert response.status_code == 202
+    assert job_queue.wait(5)
+
+    assert client.get(f"/jobs/{response.json()['id']}").json()['status'] == 'done'
+    assert client.get(f'/product/{id_product}').status_code == 404
+    assert client.get(f'/client/{id_client}').json()['favorite_products'] == []
+
+def test_missing_target_is_not_queued():
+    assert client.put('/client/update/99', json={'name': 'Magalu', 'email': 'magalu@mail.com', 'favorite_products': []}).status_code == 404
+    assert client.delete('/product/delete/99').status_code == 404
+    assert client.get('/jobs/1').status_code == 404
+
+def test_pending_job_takes_the_latest_payload():
+    applied = []
+    queue = JobQueue()
+    queue.register('noop', lambda db, target_id, payload: applied.append((target_id, payload)) or [])
+
+    with TestSessionLocal() as db:
+        # the worker can't take anything while the lock is held
+        with queue._condition:
+            first = queue.submit(db, 'noop', 1, {'step': 1})
+            second = queue.submit(db, 'noop', 1, {'step': 2})
+            other = queue.submit(db, 'noop', 2, {'step': 1})
+        assert queue.wait(5)
+
+        assert first == second != other
+        assert applied == [(1, {'step': 2}), (2, {'step': 1})]
+        assert {job.id: (job.payload, job.status) for job in db.query(Job)} == {first: ({'step': 2}, 'done'), other: ({'step': 1}, 'done')}
+
+def test_submit_doesnt_wait_for_the_running_batch():
+    applied = []
+    running, release = threading.Event(), threading.Event()
+
+    def handler(db, target_id, payload):
+        running.set()
+        assert release.wait(5)
+        applied.append(payload)
+        return []
+
+    queue = JobQueue()
+    queue.register('slow', handler)
+
+    with TestSessionLocal() as db:
+        first = queue.submit(db, 'slow', 1, {'step': 1})
+        assert running.wait(5)
+        assert db.get(Job, first).status == 'running'
+
+        # the claim is committed: the request for the same target neither waits nor changes the claimed payload
+        started = time.perf_counter()
+        second = queue.submit(db, 'slow', 1, {'step': 2})
+        assert time.perf_counter() - started < 1
+        release.set()
+        assert queue.wait(5)
+
+        assert second != first
+        assert applied == [{'step': 1}, {'step': 2}]
+        db.expire_all()
+        assert {job.id: (job.payload, job.status) for job in db.query(Job)} == {first: ({'step': 1}, 'done'), second: ({'step': 2}, 'done')}
+
+def test_stale_claims_are_taken_again(monkeypatch):
+    applied = []
+    queue = JobQueue()
+    queue.register('noop', lambda db, target_id, payload: applied.append(payload) or [])
+
+    # left running by a process that stopped while applying them
+    with TestSessionLocal() as db:
+        db.add_all([Job(kind='noop', target_id=1, payload={'step': 1}, status='running', updated_at=datetime.now() - timedelta(minutes=10)),
+                    Job(kind='noop', target_id=2, payload={'step': 1}, status='running', updated_at=datetime.now())])
+        db.commit()
+
+    monkeypatch.setattr(settings, 'JOB_CLAIM_TIMEOUT', 60)
+    queue.start()
+    assert queue.wait(5)
+
+    # the recent claim may still be applied by its process
+    assert applied == [{'step': 1}]
+    with TestSessionLocal() as db:
+        assert [job.status for job in db.query(Job).order_by(Job.id)] == ['done', 'running']
+
+def test_jobs_left_pending_are_applied_at_startup():
+    id_client = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).json()['id']
+    # recorded by a process that stopped before applying it
+    with TestSessionLocal() as db:
+        job = Job(kind='client_update', target_id=id_client, payload={'name': 'Magazine', 'email': 'magalu@mail.com', 'favorite_products': []})
+        db.add(job)
+        db.commit()
+        id_job = job.id
+
+    with TestClient(create_app(async_db=False)):
+        assert job_queue.wait(5)
+
+    assert client.get(f'/jobs/{id_job}').json()['status'] == 'done'
+    assert client.get(f'/client/{id_client}').json()['name'] == 'Magazine'
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from fastapi.testclient import TestClient
+import httpx
+from main import create_app
+from shared import metrics, settings
+from shared.load_shedding import ConcurrencyLimit, MemoryRateLimiter, parse_route_limits
+
+def test_token_bucket_refills_at_the_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    limiter = MemoryRateLimiter(rate=2, burst=2, max_clients=10)
+
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') == 0.5
+    # another client has its own bucket
+    assert limiter.acquire('b') == 0
+
+    now[0] += 0.5
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') == 0.5
+
+def test_rate_limit_answers_429(monkeypatch):
+    monkeypatch.setattr(settings, 'RATE_LIMIT', 0.1)
+    monkeypatch.setattr(settings, 'RATE_LIMIT_BURST', 2)
+    monkeypatch.setattr(settings, 'RATE_LIMIT_KEY_HEADER', 'X-Forwarded-For')
+    client = TestClient(create_app(async_db=False))
+
+    headers = {'X-Forwarded-For': '10.0.0.1, 172.16.0.1'}
+    assert client.get('/metrics', headers=headers).status_code == 200
+    assert client.get('/metrics', headers=headers).status_code == 200
+    response = client.get('/metrics', headers=headers)
+    assert response.status_code == 429
+    assert response.json() == {'detail': 'Too many requests.'}
+    assert response.headers['Retry-After'] == '10'
+
+    assert client.get('/metrics', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 200
+
+def test_route_concurrency_cap_sheds_the_queue(monkeypatch):
+    monkeypatch.setattr(settings, 'ROUTE_CONCURRENCY', '/metrics=1')
+    monkeypatch.setattr(settings, 'ROUTE_QUEUE_TIMEOUT', 0.1)
+    render_metrics = metrics.render_metrics
+
+    def slow_render_metrics() -> str:
+        time.sleep(0.3)
+        return render_metrics()
+
+    monkeypatch.setattr(metrics, 'render_metrics', slow_render_metrics)
+    app = create_app(async_db=False)
+
+    async def burst():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as http:
+            capped = asyncio.gather(*(http.get('/metrics') for _ in range(3)))
+            # the other routes don't wait for the capped one
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            other = await http.get('/docs')
+            other_seconds = time.perf_counter() - start
+            return await capped, other, other_seconds
+
+    responses, other, other_seconds = asyncio.run(burst())
+    assert sorted(response.status_code for response in responses) == [200, 503, 503]
+    assert {response.headers['Retry-After'] for response in responses if response.status_code == 503} == {'1'}
+    assert other.status_code == 200 and other_seconds < 0.2
+
+    monkeypatch.setattr(metrics, 'render_metrics', render_metrics)
+    lines = TestClient(app).get('/metrics').text.splitlines()
+    assert 'solaris_http_requests_shed_total{reason="concurrency",route="/metrics"} 2' in lines
+
+def test_concurrency_limit_hands_slots_over_in_order():
+    async def run():
+        limit = ConcurrencyLimit(1)
+        assert await limit.acquire(0)
+        assert not await limit.acquire(0)
+
+        waiting = asyncio.ensure_future(limit.acquire(1))
+        await asyncio.sleep(0)
+        limit.release()
+        assert await waiting
+        assert limit.active == 1
+
+        # a timed out waiter doesn't hold the line
+        assert not await limit.acquire(0.01)
+        limit.release()
+        assert limit.active == 0
+        assert await limit.acquire(0)
+
+    asyncio.run(run())
+
+def test_parse_route_limits():
+    assert parse_route_limits('') == {}
+    assert parse_route_limits('/client/list=8, /client/{id_client}=4') == {'/client/list': 8, '/client/{id_client}': 4}
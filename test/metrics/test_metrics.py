@@ -0,0 +1,111 @@
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from main import app
+from shared.cache import cache
+from shared.database import Base, create_db_engine
+from shared.dependencies import get_db
+
+client = TestClient(app)
+
+SQLALCHEMY_DATABASE_URL = 'sqlite:///.test.db'
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread':False})
+TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+app.dependency_overrides[get_db] = override_get_db
+
+@pytest.fixture(autouse=True)
+def setup_database():
+    # new database for each test
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    cache.clear()
+
+def test_pool_metrics():
+    pool_engine = create_db_engine('sqlite:///.test.db', name='metrics_test')
+
+    with pool_engine.connect() as first, pool_engine.connect() as second:
+        first.execute(text('SELECT 1'))
+        second.execute(text('SELECT 1'))
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        lines = response.text.splitlines()
+        assert 'solaris_db_pool_checked_out{engine="metrics_test"} 2' in lines
+        assert 'solaris_db_pool_idle{engine="metrics_test"} 0' in lines
+
+    lines = client.get('/metrics').text.splitlines()
+    assert 'solaris_db_pool_checked_out{engine="metrics_test"} 0' in lines
+    assert 'solaris_db_pool_idle{engine="metrics_test"} 2' in lines
+    assert 'solaris_db_pool_connects_total{engine="metrics_test"} 2' in lines
+    assert 'solaris_db_pool_checkouts_total{engine="metrics_test"} 2' in lines
+    assert 'solaris_db_pool_wait_seconds_count{engine="metrics_test"} 2' in lines
+
+    # a disposed engine keeps reporting through its new pool
+    pool_engine.dispose()
+    with pool_engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+
+    lines = client.get('/metrics').text.splitlines()
+    assert 'solaris_db_pool_idle{engine="metrics_test"} 1' in lines
+    assert 'solaris_db_pool_connects_total{engine="metrics_test"} 3' in lines
+    assert 'solaris_db_pool_wait_seconds_count{engine="metrics_test"} 3' in lines
+
+    pool_engine.dispose()
+
+def metric(lines, name):
+    return float(next(line for line in lines if line.startswith(name + ' ')).split()[-1])
+
+def test_request_metrics():
+    client.post('/product/register', json={"price": 10, "image": "img.jpg", "brand": "Brand", "title": "Title", "review_score": 4})
+    before = client.get('/metrics').text.splitlines()
+    label = 'method="GET",route="/product/{id_product}"'
+    count = metric(before, f'solaris_http_request_duration_seconds_count{{{label}}}') if any(label in line for line in before) else 0
+    statements = metric(before, f'solaris_http_request_db_statements_total{{{label}}}') if count else 0
+
+    cache.clear()
+    client.get('/product/1')
+    client.get('/product/1')
+
+    lines = client.get('/metrics').text.splitlines()
+    assert metric(lines, f'solaris_http_request_duration_seconds_count{{{label}}}') == count + 2
+    assert metric(lines, f'solaris_http_request_duration_seconds_bucket{{{label},le="+Inf"}}') == count + 2
+    # the second request is served by the cache
+    assert metric(lines, f'solaris_http_request_db_statements_total{{{label}}}') == statements + 1
+    assert any(line.startswith('solaris_http_request_duration_seconds_count{method="POST",route="/product/register"}') for line in lines)
+
+def test_server_timing(monkeypatch, max_queries):
+    response = client.post('/product/register', json={"price": 10, "image": "img.jpg", "brand": "Brand", "title": "Title", "review_score": 4})
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    max_queries(response, 3)
+
+    max_queries(client.get('/product/list'), 1)
+    max_queries(client.get('/product/top'), 1)
+    max_queries(client.get('/client/list'), 1)
+
+    monkeypatch.setattr('shared.settings.SERVER_TIMING', False)
+    assert 'Server-Timing' not in client.get('/product/list').headers
+
+def test_failed_statements_leave_nothing_on_the_connection(max_queries):
+    client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'})
+    for _ in range(5):
+        assert client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).status_code == 409
+
+    with engine.connect() as connection:
+        for _ in range(5):
+            with pytest.raises(Exception):
+                connection.execute(text('SELECT * FROM missing_table'))
+        connection.execute(text('SELECT 1'))
+        assert not any(key.startswith('solaris') for key in connection.info)
+
+    # the page and the favorites of its clients
+    max_queries(client.get('/client/list'), 2)
@@ -0,0 +1,67 @@
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from shared.database import Base
+# the migrations are compared against every model
+from client.models import client_model, job_model, product_model
+
+SQLALCHEMY_DATABASE_URL = 'sqlite:///.test.db'
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread':False})
+
+@pytest.fixture(autouse=True)
+def setup_database():
+    # the migrations start from an empty database
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS alembic_version'))
+    yield
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS alembic_version'))
+
+def alembic_config() -> Config:
+    config = Config('alembic.ini')
+    config.set_main_option('sqlalchemy.url', SQLALCHEMY_DATABASE_URL)
+    return config
+
+def test_migrations_match_the_models():
+    command.upgrade(alembic_config(), 'head')
+
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={'include_object': lambda object, *args: getattr(object, '_ddl_if', None) is None})
+        assert compare_metadata(context, Base.metadata) == []
+
+def test_index_revisions_downgrade():
+    config = alembic_config()
+    command.upgrade(config, 'head')
+    command.downgrade(config, '0002')
+
+    indexes = {table: {index['name'] for index in inspect(engine).get_indexes(table)}
+               for table in ('client', 'client_product', 'product', 'product_co_favorite')}
+    assert indexes == {'client': set(), 'client_product': set(), 'product': set(), 'product_co_favorite': set()}
+
+    command.upgrade(config, 'head')
+    assert 'ix_client_product_product_id' in {index['name'] for index in inspect(engine).get_indexes('client_product')}
+
+def test_upgrade_from_the_baseline_schema():
+    config = alembic_config()
+    command.upgrade(config, '0001')
+    assert set(inspect(engine).get_table_names()) == {'alembic_version', 'client', 'client_product', 'product'}
+    assert {column['name'] for column in inspect(engine).get_columns('product')} == {'id', 'price', 'image', 'brand', 'title', 'review_score'}
+
+    # rows written by the original models
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO client (id, name, email) VALUES (1, 'Magalu', 'magalu@mail.com'), (2, 'Luiza', 'luiza@mail.com')"))
+        connection.execute(text("INSERT INTO product (id, price, title) VALUES (1, 10, 'Chair'), (2, 20, 'Table')"))
+        connection.execute(text('INSERT INTO client_product (client_id, product_id) VALUES (1, 1), (2, 1)'))
+
+    command.upgrade(config, 'head')
+    with engine.connect() as connection:
+        assert connection.execute(text('SELECT version FROM client ORDER BY id')).scalars().all() == [1, 1]
+        assert connection.execute(text('SELECT id, version, favorite_count FROM product ORDER BY id')).all() == [(1, 1, 2), (2, 1, 0)]
+
+    command.downgrade(config, '0001')
+    assert {column['name'] for column in inspect(engine).get_columns('client')} == {'id', 'name', 'email', 'created_at'}
+    assert 'job' not in inspect(engine).get_table_names()
@@ -1,12 +1,21 @@
+import json
+import random
 from fastapi import HTTPException
 from fastapi.testclient import TestClient
 import pytest
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert, select, update
+from client.jobs.co_favorites import rebuild_co_favorites
+from client.jobs.favorite_counts import reconcile_favorite_counts
+from client.models.product_model import Product, product_co_favorite
+from client.routers.utils import encode_cursor
 from main import app
+from shared import settings
+from shared.cache import cache
 from shared.database import Base
 from shared.dependencies import get_db
 from shared.exceptions import NotFound
+from shared.row_count import clear_row_counts
 
 client = TestClient(app)
 
@@ -28,6 +37,8 @@ def setup_database():
     # new database for each test
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    cache.clear()
+    clear_row_counts()
 
 def test_successful_product_registration():
     new_product = { "price": 5000,
@@ -146,3 +157,384 @@ def test_empty_product_list():
     assert product_response.status_code == 200
     assert product_response.json() == []
 
+
+def test_product_list_with_cursor():
+    for i in range(5):
+        product = { "price": 1000 * (i + 1),
+                    "image": f"img00{i}.jpg",
+                    "brand": "Brand",
+                    "title": f"Title {i}",
+                    "review_score": 4
+                  }
+        product_response = client.post('/product/register', json=product)
+        assert product_response.status_code == 201
+
+    first_page = client.get('/product/list', params={'page_size': 2})
+    assert [p['id'] for p in first_page.json()] == [1, 2]
+
+    second_page = client.get('/product/list', params={'page_size': 2, 'cursor': first_page.headers['X-Next-Cursor']})
+    assert [p['id'] for p in second_page.json()] == [3, 4]
+
+    third_page = client.get('/product/list', params={'page_size': 2, 'cursor': second_page.headers['X-Next-Cursor']})
+    assert [p['id'] for p in third_page.json()] == [5]
+    assert 'X-Next-Cursor' not in third_page.headers
+
+    # offset pagination keeps working for old clients
+    assert client.get('/product/list', params={'page_size': 2, 'page': 2}).json() == second_page.json()
+
+def test_product_list_with_total():
+    product = { "price": 5000,
+                "image": "img001.jpg",
+                "brand": "Brand 1",
+                "title": "Title 1",
+                "review_score": 4.75
+              }
+
+    product_response = client.get('/product/list')
+    assert 'X-Total-Count' not in product_response.headers
+
+    product_response = client.get('/product/list', params={'include_total': True, 'page_size': 2})
+    assert product_response.headers['X-Total-Count'] == '0'
+    assert product_response.headers['X-Total-Pages'] == '0'
+
+    # the cached count follows the writes made through the api
+    for _ in range(3):
+        assert client.post('/product/register', json=product).status_code == 201
+
+    product_response = client.get('/product/list', params={'include_total': True, 'page_size': 2})
+    assert product_response.headers['X-Total-Count'] == '3'
+    assert product_response.headers['X-Total-Pages'] == '2'
+
+    assert client.delete('/product/delete/1').status_code == 204
+    product_response = client.get('/product/list', params={'include_total': True, 'page_size': 2})
+    assert product_response.headers['X-Total-Count'] == '2'
+    assert product_response.headers['X-Total-Pages'] == '1'
+
+def test_product_by_id_conditional_get():
+    new_product = { "price": 5000,
+                    "image": "img001.jpg",
+                    "brand": "Brand 1",
+                    "title": "Title 1",
+                    "review_score": 4.75
+                  }
+
+    product_response = client.post('/product/register', json=new_product)
+    assert product_response.status_code == 201
+
+    product_response = client.get('/product/1')
+    assert product_response.status_code == 200
+    etag = product_response.headers['ETag']
+    assert etag.startswith('W/"')
+
+    product_response = client.get('/product/1', headers={'If-None-Match': etag})
+    assert product_response.status_code == 304
+    assert product_response.headers['ETag'] == etag
+    assert product_response.content == b''
+
+    # also answered without the cached payload
+    cache.clear()
+    product_response = client.get('/product/1', headers={'If-None-Match': f'"other", {etag}'})
+    assert product_response.status_code == 304
+
+    product_response = client.get('/product/1', headers={'If-None-Match': '"other"'})
+    assert product_response.status_code == 200
+
+def test_product_list_last_modified():
+    new_product = { "price": 5000,
+                    "image": "img001.jpg",
+                    "brand": "Brand 1",
+                    "title": "Title 1",
+                    "review_score": 4.75
+                  }
+
+    product_response = client.get('/product/list')
+    assert 'Last-Modified' not in product_response.headers
+
+    product_response = client.post('/product/register', json=new_product)
+    assert product_response.status_code == 201
+
+    product_response = client.get('/product/list')
+    assert product_response.headers['Last-Modified'].endswith(' GMT')
+
+def test_bulk_product_import_ndjson(monkeypatch):
+    monkeypatch.setattr(settings, 'BULK_CHUNK_SIZE', 2)
+    rows = [{"price": 10 * i, "image": f"img{i}.jpg", "brand": "Brand", "title": f"Title {i}", "review_score": 4} for i in range(5)]
+    lines = [json.dumps(row) for row in rows]
+    lines.insert(2, '{"price": "free", "image": "img.jpg", "brand": "Brand", "title": "Title", "review_score": 4}')
+    lines.insert(4, 'not json')
+    lines.append('')
+
+    product_response = client.post('/product/bulk', content='\n'.join(lines), headers={'Content-Type': 'application/x-ndjson'})
+    assert product_response.status_code == 200
+    report = product_response.json()
+    assert report['inserted'] == 5
+    assert report['failed'] == 2
+    assert [error['line'] for error in report['errors']] == [3, 5]
+    assert report['errors'][0]['detail'][0]['loc'] == ['price']
+
+    product_response = client.get('/product/list')
+    assert [product['title'] for product in product_response.json()] == [f'Title {i}' for i in range(5)]
+
+def test_bulk_product_import_csv():
+    body = 'price,image,brand,title,review_score\r\n5000,img001.jpg,Brand 1,"Title, 1",4.75\r\n10000,img002.jpg,Brand 2\r\n'
+
+    product_response = client.post('/product/bulk', content=body, headers={'Content-Type': 'text/csv'})
+    assert product_response.status_code == 200
+    assert product_response.json() == {'inserted': 1,
+                                       'failed': 1,
+                                       'errors': [{'line': 3, 'detail': [{'loc': [], 'msg': 'Expected 5 columns, got 3.'}]}]}
+
+    product_response = client.get('/product/1')
+    assert product_response.json() == {"id": 1,
+                                       "price": 5000,
+                                       "image": "img001.jpg",
+                                       "brand": "Brand 1",
+                                       "title": "Title, 1",
+                                       "review_score": 4.75
+                                      }
+
+def test_product_list_fast_path_matches_orm_path(monkeypatch):
+    for i in range(3):
+        new_product = { "price": 10.5 * i,
+                        "image": f"img00{i}.jpg",
+                        "brand": "Brand",
+                        "title": f"Title {i}",
+                        "review_score": 4.5
+                      }
+        assert client.post('/product/register', json=new_product).status_code == 201
+
+    monkeypatch.setattr(settings, 'FAST_READS', True)
+    fast = client.get('/product/list', params={'page_size': 2, 'include_total': True})
+    monkeypatch.setattr(settings, 'FAST_READS', False)
+    orm = client.get('/product/list', params={'page_size': 2, 'include_total': True})
+
+    assert fast.json() == orm.json()
+    for header in ('X-Next-Cursor', 'X-Total-Count', 'Last-Modified'):
+        assert fast.headers[header] == orm.headers[header]
+
+@pytest.mark.parametrize('fast_reads', [True, False])
+def test_product_list_filters_and_sort(monkeypatch, fast_reads):
+    monkeypatch.setattr(settings, 'FAST_READS', fast_reads)
+    catalog = [("Brand A", "Blue Shirt", 50, 4.5),
+               ("Brand A", "Red Shirt", 30, 3.0),
+               ("Brand B", "Blue Pants", 30, 4.8),
+               ("Brand B", "50% Off Hat", 10, 4.0),
+               ("Brand A", "Blue Hat", 70, 5.0)]
+    for brand, title, price, review_score in catalog:
+        new_product = {"price": price, "image": "img.jpg", "brand": brand, "title": title, "review_score": review_score}
+        assert client.post('/product/register', json=new_product).status_code == 201
+
+    def titles(**params):
+        return [product['title'] for product in client.get('/product/list', params=params).json()]
+
+    assert titles(brand='Brand A') == ['Blue Shirt', 'Red Shirt', 'Blue Hat']
+    assert titles(min_price=30, max_price=50) == ['Blue Shirt', 'Red Shirt', 'Blue Pants']
+    assert titles(min_review_score=4.5) == ['Blue Shirt', 'Blue Pants', 'Blue Hat']
+    assert titles(title='blue') == ['Blue Shirt', 'Blue Pants', 'Blue Hat']
+    assert titles(title='50%') == ['50% Off Hat']
+    assert titles(title_prefix='blue s') == ['Blue Shirt']
+    assert titles(sort_by='price') == ['50% Off Hat', 'Red Shirt', 'Blue Pants', 'Blue Shirt', 'Blue Hat']
+    assert titles(sort_by='review_score', order='desc', brand='Brand A') == ['Blue Hat', 'Blue Shirt', 'Red Shirt']
+
+    product_response = client.get('/product/list', params={'brand': 'Brand A', 'include_total': True})
+    assert product_response.headers['X-Total-Count'] == '3'
+
+    # walk the whole catalog by price, descending, two products at a time
+    seen = []
+    params = {'sort_by': 'price', 'order': 'desc', 'page_size': 2}
+    while True:
+        product_response = client.get('/product/list', params=params)
+        seen += [product['title'] for product in product_response.json()]
+        if 'X-Next-Cursor' not in product_response.headers:
+            break
+        params['cursor'] = product_response.headers['X-Next-Cursor']
+    assert seen == ['Blue Hat', 'Blue Shirt', 'Blue Pants', 'Red Shirt', '50% Off Hat']
+
+    # a cursor only works with the sort order it was created for
+    product_response = client.get('/product/list', params={'sort_by': 'price', 'cursor': params['cursor']})
+    assert product_response.status_code == 400
+
+@pytest.mark.parametrize('fast_reads', [True, False])
+@pytest.mark.parametrize('sort_by, order', [('price', 'asc'), ('review_score', 'desc')])
+def test_product_cursor_walk_with_non_terminating_decimals(monkeypatch, fast_reads, sort_by, order):
+    monkeypatch.setattr(settings, 'FAST_READS', fast_reads)
+    # thirds and sevenths: neither a float repr nor a Decimal cut to 10 places is the stored value, and values repeat
+    with TestSessionLocal() as db:
+        db.execute(insert(Product), [{'price': (number % 100) / 3, 'image': 'img.jpg', 'brand': 'Brand', 'title': f'Title {number}',
+                                      'review_score': (number % 50) / 7} for number in range(300)])
+        db.commit()
+
+    seen = []
+    params = {'sort_by': sort_by, 'order': order, 'page_size': 7}
+    for _ in range(100):
+        product_response = client.get('/product/list', params=params)
+        seen += [product['id'] for product in product_response.json()]
+        if 'X-Next-Cursor' not in product_response.headers:
+            break
+        params['cursor'] = product_response.headers['X-Next-Cursor']
+        if len(seen) == 140:
+            # the last row of the page is gone, the walk goes on from the (approximate) value in the cursor
+            client.delete(f'/product/delete/{seen[-1]}')
+    else:
+        pytest.fail('the walk never ended')
+    # nothing skipped; a row sharing the deleted row's value may come twice
+    assert set(seen) == set(range(1, 301))
+    assert len(seen) - len(set(seen)) <= 1
+
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_product_cursor_walk_over_null_prices(monkeypatch, order):
+    # rows without a price don't come from the API (ProductResponse requires one), only the plain rows path lists them
+    monkeypatch.setattr(settings, 'FAST_READS', True)
+    with TestSessionLocal() as db:
+        db.execute(insert(Product), [{'price': None if number % 3 == 0 else number % 4, 'image': 'img.jpg', 'brand': 'Brand',
+                                      'title': f'Title {number}', 'review_score': 4} for number in range(20)])
+        db.commit()
+
+    seen = []
+    params = {'sort_by': 'price', 'order': order, 'page_size': 3}
+    for _ in range(20):
+        product_response = client.get('/product/list', params=params)
+        assert product_response.status_code == 200
+        seen += [(product['price'], product['id']) for product in product_response.json()]
+        if 'X-Next-Cursor' not in product_response.headers:
+            break
+        params['cursor'] = product_response.headers['X-Next-Cursor']
+    else:
+        pytest.fail('the walk never ended')
+
+    # NULL sorts as the largest price, the id breaks ties
+    prices = {number + 1: None if number % 3 == 0 else number % 4 for number in range(20)}
+    if order == 'asc':
+        expected = sorted(prices, key=lambda id_product: (prices[id_product] is None, prices[id_product] or 0, id_product))
+    else:
+        expected = sorted(prices, key=lambda id_product: (prices[id_product] is not None, -(prices[id_product] or 0), -id_product))
+    assert [id_product for _, id_product in seen] == expected
+
+def test_product_list_rejects_forged_cursors():
+    for values in (['price:asc', 'abc', 1], ['price:asc', 'NaN', 1], ['price:asc', [1], 1], ['review_score:desc', 'Infinity', 1]):
+        sort_by, order = values[0].split(':')
+        product_response = client.get('/product/list', params={'sort_by': sort_by, 'order': order, 'cursor': encode_cursor(*values)})
+        assert product_response.status_code == 400
+
+@pytest.mark.parametrize('fast_reads', [True, False])
+def test_top_products_follow_favorite_changes(monkeypatch, fast_reads):
+    monkeypatch.setattr(settings, 'FAST_READS', fast_reads)
+    for i in range(4):
+        new_product = {"price": 10, "image": "img.jpg", "brand": "Brand", "title": f"Title {i + 1}", "review_score": 4}
+        assert client.post('/product/register', json=new_product).status_code == 201
+    ids = [client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'}).json()['id'] for i in range(3)]
+
+    def top(limit=10):
+        return [(product['id'], product['favorite_count']) for product in client.get('/product/top', params={'limit': limit}).json()]
+
+    client.put(f'/client/update/{ids[0]}', json={'name': 'Client 0', 'email': 'client0@mail.com', 'favorite_products': [1, 2]})
+    # repeated and unknown ids don't count
+    client.post(f'/client/{ids[1]}/favorites', json={'product_ids': [2, 3, 3, 99]})
+    client.post(f'/client/{ids[1]}/favorites', json={'product_ids': [2]})
+    client.post(f'/client/{ids[2]}/favorites', json={'product_ids': [2, 3]})
+    assert top() == [(2, 3), (3, 2), (1, 1), (4, 0)]
+    assert top(limit=2) == [(2, 3), (3, 2)]
+
+    client.request('DELETE', f'/client/{ids[2]}/favorites', json={'product_ids': [3, 4]})
+    client.put(f'/client/update/{ids[0]}', json={'name': 'Client 0', 'email': 'client0@mail.com', 'favorite_products': [1, 4]})
+    client.delete(f'/client/delete/{ids[1]}')
+    assert top() == [(4, 1), (2, 1), (1, 1), (3, 0)]
+
+    client.delete('/product/delete/4')
+    assert top() == [(2, 1), (1, 1), (3, 0)]
+
+def test_top_products_keep_product_etag():
+    new_product = {"price": 10, "image": "img.jpg", "brand": "Brand", "title": "Title", "review_score": 4}
+    client.post('/product/register', json=new_product)
+    client_id = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).json()['id']
+    etag = client.get('/product/1').headers['ETag']
+
+    # the count isn't part of the product payload, favoriting it leaves the version alone
+    client.post(f'/client/{client_id}/favorites', json={'product_ids': [1]})
+    product_response = client.get('/product/1', headers={'If-None-Match': etag})
+    assert product_response.status_code == 304
+
+def test_reconcile_favorite_counts():
+    for i in range(3):
+        new_product = {"price": 10, "image": "img.jpg", "brand": "Brand", "title": f"Title {i + 1}", "review_score": 4}
+        client.post('/product/register', json=new_product)
+    client_id = client.post('/client/register', json={'name': 'Magalu', 'email': 'magalu@mail.com'}).json()['id']
+    client.post(f'/client/{client_id}/favorites', json={'product_ids': [1, 2]})
+
+    with TestSessionLocal() as db:
+        db.execute(update(Product).where(Product.id.in_([1, 3])).values(favorite_count=7))
+        db.commit()
+        assert reconcile_favorite_counts(db) == 2
+        assert reconcile_favorite_counts(db) == 0
+
+    product_response = client.get('/product/top')
+    assert [(product['id'], product['favorite_count']) for product in product_response.json()] == [(2, 1), (1, 1), (3, 0)]
+
+def co_favorite_pairs():
+    with TestSessionLocal() as db:
+        return sorted(tuple(row) for row in db.execute(select(product_co_favorite)) if row.count)
+
+def test_related_products_follow_favorite_changes():
+    for i in range(5):
+        new_product = {"price": 10, "image": "img.jpg", "brand": "Brand", "title": f"Title {i + 1}", "review_score": 4}
+        client.post('/product/register', json=new_product)
+    ids = [client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'}).json()['id'] for i in range(3)]
+
+    def related(id_product):
+        return [(product['id'], product['co_favorites']) for product in client.get(f'/product/{id_product}/related').json()]
+
+    client.put(f'/client/update/{ids[0]}', json={'name': 'Client 0', 'email': 'client0@mail.com', 'favorite_products': [1, 2, 3]})
+    client.post(f'/client/{ids[1]}/favorites', json={'product_ids': [1, 2]})
+    client.post(f'/client/{ids[2]}/favorites', json={'product_ids': [1, 4]})
+    assert related(1) == [(2, 2), (4, 1), (3, 1)]
+    assert related(5) == []
+
+    client.request('DELETE', f'/client/{ids[1]}/favorites', json={'product_ids': [2]})
+    client.put(f'/client/update/{ids[0]}', json={'name': 'Client 0', 'email': 'client0@mail.com', 'favorite_products': [1, 3, 5]})
+    client.request('DELETE', '/client/batch', params={'ids': [ids[2]]})
+    assert related(1) == [(5, 1), (3, 1)]
+    assert related(3) == [(5, 1), (1, 1)]
+
+    client.delete('/product/delete/5')
+    assert related(1) == [(3, 1)]
+    assert client.get('/product/5/related').status_code == 404
+
+def test_co_favorites_follow_overlapping_changes():
+    # changes overlapping the favorites already there, pairs inside the change counted once
+    rng = random.Random(1)
+    with TestSessionLocal() as db:
+        db.execute(insert(Product), [{'price': 10, 'image': 'img.jpg', 'brand': 'Brand', 'title': f'Title {i}', 'review_score': 4} for i in range(12)])
+        db.commit()
+    ids = [client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'}).json()['id'] for i in range(4)]
+
+    for _ in range(30):
+        id_client, product_ids = rng.choice(ids), rng.sample(range(1, 13), rng.randint(1, 5))
+        if rng.random() < 0.6:
+            client.post(f'/client/{id_client}/favorites', json={'product_ids': product_ids})
+        else:
+            client.request('DELETE', f'/client/{id_client}/favorites', json={'product_ids': product_ids})
+        incremental = co_favorite_pairs()
+        with TestSessionLocal() as db:
+            rebuild_co_favorites(db)
+        assert co_favorite_pairs() == incremental
+
+@pytest.mark.parametrize('sparse', [True, False])
+def test_rebuild_co_favorites_matches_incremental_index(monkeypatch, sparse):
+    if sparse:
+        pytest.importorskip('scipy')
+    else:
+        monkeypatch.setattr('client.jobs.co_favorites.find_spec', lambda name: None)
+
+    for i in range(6):
+        new_product = {"price": 10, "image": "img.jpg", "brand": "Brand", "title": f"Title {i + 1}", "review_score": 4}
+        client.post('/product/register', json=new_product)
+    for i, favorites in enumerate([[1, 2, 3], [2, 3], [3, 4, 5, 6], [6], []]):
+        id_client = client.post('/client/register', json={'name': f'Client {i}', 'email': f'client{i}@mail.com'}).json()['id']
+        client.post(f'/client/{id_client}/favorites', json={'product_ids': favorites})
+    client.request('DELETE', '/client/1/favorites', json={'product_ids': [1]})
+
+    incremental = co_favorite_pairs()
+    with TestSessionLocal() as db:
+        assert rebuild_co_favorites(db) == len(incremental)
+    assert co_favorite_pairs() == incremental
+    assert (2, 3, 2) in incremental
@@ -0,0 +1,54 @@
+from fastapi.testclient import TestClient
+import os
+from main import configure_workers, create_app, server_options
+from shared import database, settings
+from shared.metrics import render_metrics
+
+def test_server_options_defaults_and_flags(monkeypatch):
+    options = server_options([])
+    assert options['app'] == 'main:create_app' and options['factory'] is True
+    assert options['workers'] == settings.SERVER_WORKERS
+    assert options['loop'] == 'auto' and options['http'] == 'auto'
+
+    options = server_options(['--workers', '3', '--port', '8000', '--keep-alive', '15', '--backlog', '512', '--no-access-log'])
+    assert options['workers'] == 3
+    assert options['port'] == 8000
+    assert options['timeout_keep_alive'] == 15
+    assert options['backlog'] == 512
+    assert options['access_log'] is False
+
+def test_memory_cache_disabled_with_several_workers(monkeypatch):
+    monkeypatch.delenv('SOLARIS_CACHE_BACKEND', raising=False)
+    monkeypatch.setattr(settings, 'CACHE_BACKEND', 'memory')
+    configure_workers(1)
+    assert 'SOLARIS_CACHE_BACKEND' not in os.environ
+
+    configure_workers(4)
+    assert os.environ['SOLARIS_CACHE_BACKEND'] == 'none'
+
+    monkeypatch.setenv('SOLARIS_CACHE_BACKEND', 'redis')
+    monkeypatch.setattr(settings, 'CACHE_BACKEND', 'redis')
+    configure_workers(4)
+    assert os.environ['SOLARIS_CACHE_BACKEND'] == 'redis'
+
+def test_engine_created_on_first_use_and_disposed_on_shutdown(monkeypatch):
+    monkeypatch.setattr(settings, 'DATABASE_URL', 'sqlite:///.test.db')
+    monkeypatch.setattr(database, '_engine', None)
+
+    with TestClient(create_app(async_db=False)) as client:
+        assert database._engine is None
+        assert client.get('/metrics').status_code == 200
+        engine = database.get_engine()
+        assert database.get_engine() is engine
+
+    # the lifespan disposed of it, the next use starts a new pool
+    assert database._engine is None
+
+def test_engine_warm_up_on_startup(monkeypatch):
+    monkeypatch.setattr(settings, 'DATABASE_URL', 'sqlite:///.test.db')
+    monkeypatch.setattr(settings, 'DB_WARMUP', True)
+    monkeypatch.setattr(database, '_engine', None)
+
+    with TestClient(create_app(async_db=False)):
+        assert database._engine is not None
+        assert 'solaris_db_pool_connects_total{engine="sync"} 1' in render_metrics().splitlines()